@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#Benchmark de los dos explicadores de SAINT sobre una partición guardada: gradiente x LRP (ExplainationGenerator)
+#frente al rollout de atención solo con forward (RolloutExplainer). Mide la latencia por batch y el acuerdo de los
+#rankings de variables (Spearman por fila, solape del top-k por fila y Spearman de la relevancia media). Ejemplo:
+#   benchmark_explainers.py --dset_id 54 --task multiclass --fold 0 --epochs 20
+import argparse
+import time
+import torch
+import numpy as np
+from scipy.stats import spearmanr
+
+import models
+from datasets.loadData import TensorLoader
+from functions import base_parser, adjust_options, load_fold, create_model, select_criterion, select_optimizer, train, predict_all
+
+parser = argparse.ArgumentParser(parents=[base_parser()])
+parser.add_argument('--fold', default=0, type=int)
+parser.add_argument('--repeats', default=3, type=int)
+parser.add_argument('--topk', default=3, type=int)
+parser.add_argument('--threads', default=None, type=int)
+parser.set_defaults(epochs=20)
+opt = parser.parse_args()
+
+torch.manual_seed(opt.set_seed)
+if opt.threads is not None:
+    torch.set_num_threads(opt.threads)
+device = torch.device("cpu")
+
+dataset = load_fold(opt, ["train"])["train"]
+
+#la explicación LRP solo está implementada para colrow; mismos ajustes que main.py
+opt.attentiontype = 'colrow'
+adjust_options(opt, dataset.num_features())
+y_dim = dataset.num_classes
+print("Entrenando SAINT (" + str(opt.epochs) + " epochs) en el dataset " + str(opt.dset_id) + ", fold " + str(opt.fold) + "...")
+model = create_model(dataset, y_dim, opt).to(device)
+optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, opt.epochs, opt.lr)
+model = train(model, TensorLoader(dataset, batch_size=opt.batchsize, shuffle=True), opt.task, opt.epochs, device, select_criterion(y_dim, opt.task, device), opt.optimizer, optimizer, scheduler)
+
+loader = TensorLoader(dataset, batch_size=opt.batchsize, shuffle=False)
+results = {}
+for name, explainator in (("lrp", models.ExplainationGenerator(model)), ("rollout", models.RolloutExplainer(model))):
+    start = time.perf_counter()
+    for _ in range(opt.repeats):
+        expls, y_pred, _ = predict_all(model, explainator, loader, device)
+    elapsed = (time.perf_counter() - start) / opt.repeats
+    results[name] = {"expls": expls.detach().numpy(), "y_pred": y_pred, "time": elapsed}
+
+print("\n%-10s %16s %16s" % ("explicador", "ms por batch", "filas/s"))
+for name, result in results.items():
+    print("%-10s %16.2f %16.1f" % (name, 1000 * result["time"] / len(loader), len(dataset) / result["time"]))
+print("Speedup del rollout: %.1fx" % (results["lrp"]["time"] / results["rollout"]["time"]))
+
+lrp, rollout = results["lrp"]["expls"], results["rollout"]["expls"]
+rows = [spearmanr(a, b)[0] for a, b in zip(lrp, rollout)]
+top_lrp = np.argsort(-lrp, axis=1)[:, :opt.topk]
+top_rollout = np.argsort(-rollout, axis=1)[:, :opt.topk]
+overlap = [len(set(a) & set(b)) / opt.topk for a, b in zip(top_lrp, top_rollout)]
+print("\nPredicciones iguales: " + str(bool((results["lrp"]["y_pred"] == results["rollout"]["y_pred"]).all())))
+print("Spearman medio por fila: %.4f" % np.nanmean(rows))
+print("Solape medio del top-%d por fila: %.4f" % (opt.topk, np.mean(overlap)))
+print("Spearman de la relevancia media por variable: %.4f" % spearmanr(lrp.mean(axis=0), rollout.mean(axis=0))[0])
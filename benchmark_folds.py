@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#Benchmark del entrenamiento de los modelos de todas las particiones de un dataset guardado en datasets_prepo:
+#uno detrás de otro con functions.train frente a todos a la vez con functions.train_folds (torch.func, vmap).
+#Los modelos de partida son los mismos en los dos casos. Ejemplo:
+#   benchmark_folds.py --dset_id 54 --task multiclass --epochs 20 --attentiontype col
+import argparse
+import copy
+import time
+import torch
+
+from datasets.loadData import TensorLoader
+from functions import base_parser, adjust_options, dataset_path, load_folds, create_model, create_metric, select_criterion, select_optimizer, train, train_folds, predict
+
+parser = argparse.ArgumentParser(parents=[base_parser()])
+parser.add_argument('--threads', default=None, type=int)
+parser.set_defaults(epochs=20)
+opt = parser.parse_args()
+
+torch.manual_seed(opt.set_seed)
+if opt.threads is not None:
+    torch.set_num_threads(opt.threads)
+device = torch.device("cpu")
+
+loaded = load_folds(dataset_path(opt.savedatasetroot, opt.task, opt.dset_id))
+folders = {split: [loaded[split]["fold" + str(k)] for k in range(len(loaded[split]))] for split in loaded}
+nfeat = folders["train"][0].num_features()
+adjust_options(opt, nfeat) #mismos ajustes que main.py
+
+y_dim = folders["train"][0].num_classes if opt.task != 'regression' else 1
+criterion = select_criterion(y_dim, opt.task, device)
+sequential = [create_model(dataset, y_dim, opt).to(device) for dataset in folders["train"]]
+stacked = copy.deepcopy(sequential)
+
+print("Dataset " + str(opt.dset_id) + ": " + str(len(sequential)) + " particiones, " + str(nfeat) + " variables, " + str(opt.epochs) + " epochs")
+start = time.perf_counter()
+for model, dataset in zip(sequential, folders["train"]):
+    optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, opt.epochs, opt.lr)
+    train(model, TensorLoader(dataset, batch_size=opt.batchsize, shuffle=True), opt.task, opt.epochs, device, criterion, opt.optimizer, optimizer, scheduler)
+time_sequential = time.perf_counter() - start
+
+start = time.perf_counter()
+train_folds(stacked, [TensorLoader(dataset, batch_size=opt.batchsize, shuffle=True) for dataset in folders["train"]], opt.task, opt.epochs, device, criterion, opt.optimizer, opt.scheduler, opt.lr)
+time_stacked = time.perf_counter() - start
+
+print("\n%-10s %14s %14s" % ("partición", "secuencial", "vmap"))
+for k, dataset in enumerate(folders["test"]):
+    metric, metric_name = create_metric(opt.task, y_dim, device)
+    values = []
+    for model in (sequential[k], stacked[k]):
+        y_pred, y_gts = predict(model, TensorLoader(dataset, batch_size=len(dataset)), device)
+        values.append(metric(torch.squeeze(y_pred), torch.squeeze(y_gts)).item())
+    print("%-10s %14.4f %14.4f" % ("fold" + str(k), values[0], values[1]))
+print("%-10s %14.2f %14.2f" % ("tiempo (s)", time_sequential, time_stacked))
+print("Speedup: %.2fx" % (time_sequential / time_stacked))
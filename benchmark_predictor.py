@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#Benchmark de inferencia en CPU: SAINT eager (functions.predict) frente a SAINTPredictor compilado
+#sobre una partición guardada en datasets_prepo. Ejemplo:
+#   benchmark_predictor.py --dset_id 54 --task multiclass --fold 0 --backend compile
+import argparse
+import os
+import time
+import torch
+import numpy as np
+
+import models
+from datasets.loadData import TensorLoader
+from functions import load_fold, predict
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dset_id', required=True, type=int)
+parser.add_argument('--task', required=True, type=str, choices = ['binary','multiclass','regression'])
+parser.add_argument('--fold', default=0, type=int)
+parser.add_argument('--savedatasetroot', default=os.path.relpath('./datasets/datasets_prepo'), type=str)
+parser.add_argument('--backend', default='compile', type=str, choices = ['compile','trace'])
+parser.add_argument('--batchsizes', default=[1, 16, 64, 256], type=int, nargs='+')
+parser.add_argument('--repeats', default=20, type=int)
+parser.add_argument('--threads', default=None, type=int)
+parser.add_argument('--embedding_size', default=32, type=int)
+parser.add_argument('--transformer_depth', default=1, type=int)
+parser.add_argument('--attention_heads', default=4, type=int)
+parser.add_argument('--attentiontype', default='colrow', type=str, choices = ['col','colrow','row'])
+opt = parser.parse_args()
+
+torch.manual_seed(1)
+if opt.threads is not None:
+    torch.set_num_threads(opt.threads)
+device = torch.device("cpu")
+
+dataset = load_fold(opt, ["test"])["test"]
+
+#mismo modelo que en cross_validation_process (los pesos no influyen en el rendimiento)
+cat_dims = [dataset.dataCat[i][2] for i in range(len(dataset.dataCat))]
+cat_dims = np.append(np.array([1]),np.array(cat_dims)).astype(int)
+nfeat = dataset.cat.shape[1] + dataset.cont.shape[1]
+model = models.SAINT(
+    num_features = nfeat + 1,
+    categories = tuple(cat_dims),
+    num_continuous = dataset.cont.shape[1],
+    dim = opt.embedding_size,
+    depth = opt.transformer_depth,
+    heads = opt.attention_heads,
+    attentiontype = opt.attentiontype,
+    y_dim = dataset.num_classes if opt.task != 'regression' else 1,
+    pretraining_heads = False
+).to(device).eval()
+
+predictor = models.SAINTPredictor(model, backend=opt.backend, buckets=opt.batchsizes)
+
+print("Dataset " + str(opt.dset_id) + " (fold " + str(opt.fold) + "): " + str(len(dataset)) + " filas, " + str(nfeat) + " variables, backend " + opt.backend)
+print("%10s %16s %16s %10s %12s" % ("batchsize", "eager filas/s", "compilado filas/s", "speedup", "preds iguales"))
+for batchsize in opt.batchsizes:
+    loader = TensorLoader(dataset, batch_size=batchsize, shuffle=False)
+    #calentamiento (la compilación de cada bucket ocurre aquí)
+    y_eager, _ = predict(model, loader, device)
+    y_compiled, _ = predictor.predict(loader, device)
+
+    start = time.perf_counter()
+    for _ in range(opt.repeats):
+        predict(model, loader, device)
+    eager = len(dataset) * opt.repeats / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(opt.repeats):
+        predictor.predict(loader, device)
+    compiled = len(dataset) * opt.repeats / (time.perf_counter() - start)
+
+    print("%10d %16.1f %16.1f %9.2fx %12s" % (batchsize, eager, compiled, compiled / eager, bool((y_eager == y_compiled).all())))
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#Informe de paridad de SAINT con autocast a bfloat16 (--bf16 en main.py) frente a float32 sobre una partición
+#guardada: se entrenan los dos modelos con la misma semilla y se comparan accuracy, tiempos y explicaciones. Ejemplo:
+#   bf16_report.py --dset_id 54 --task multiclass --fold 0 --epochs 20
+import argparse
+import time
+import torch
+import numpy as np
+from scipy.stats import spearmanr
+
+import models
+from datasets.loadData import TensorLoader
+from functions import base_parser, adjust_options, load_fold, create_model, create_metric, select_criterion, select_optimizer, train, predict, predict_all
+
+parser = argparse.ArgumentParser(parents=[base_parser()])
+parser.add_argument('--fold', default=0, type=int)
+parser.add_argument('--explain_rows', default=1024, type=int) #filas de train que se explican (la relprop es cara)
+parser.set_defaults(epochs=20)
+opt = parser.parse_args()
+
+device = torch.device("cpu")
+
+folders = load_fold(opt)
+adjust_options(opt, folders["train"].num_features()) #mismos ajustes que main.py
+
+y_dim = folders["train"].num_classes
+testloader = TensorLoader(folders["test"], batch_size=len(folders["test"]), shuffle=False)
+explain_rows = min(opt.explain_rows, len(folders["train"]))
+explainloader = TensorLoader(folders["train"], batch_size=explain_rows, shuffle=False, indices=np.arange(explain_rows))
+
+def run(bf16):
+    torch.manual_seed(opt.set_seed)
+    trainloader = TensorLoader(folders["train"], batch_size=opt.batchsize, shuffle=True)
+    model = create_model(folders["train"], y_dim, opt).to(device)
+    optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, opt.epochs, opt.lr)
+    start = time.perf_counter()
+    model = train(model, trainloader, opt.task, opt.epochs, device, select_criterion(y_dim, opt.task, device), opt.optimizer, optimizer, scheduler, bf16=bf16)
+    train_time = time.perf_counter() - start
+    y_pred, y_gts = predict(model, testloader, device, bf16)
+    metric, _ = create_metric(opt.task, y_dim, device)
+    start = time.perf_counter()
+    expls, _, _ = predict_all(model, models.ExplainationGenerator(model), explainloader, device, bf16=bf16)
+    explain_time = time.perf_counter() - start
+    return {"model": model, "y_pred": y_pred, "y_gts": y_gts, "accuracy": metric(torch.squeeze(y_pred), torch.squeeze(y_gts)).item(),
+            "train": train_time, "explain": explain_time, "expls": expls.detach()}
+
+print("Entrenando SAINT float32 y bf16 (" + str(opt.epochs) + " epochs) en el dataset " + str(opt.dset_id) + ", fold " + str(opt.fold) + "...")
+results = {"float32": run(False), "bf16": run(True)}
+
+print("\n%-8s %10s %16s %18s" % ("modelo", "accuracy", "entrenamiento (s)", "explicación (s)"))
+for name, result in results.items():
+    print("%-8s %10.4f %16.2f %18.2f" % (name, result["accuracy"], result["train"], result["explain"]))
+
+float32, bf16 = results["float32"], results["bf16"]
+print("\nDiferencia de accuracy (bf16 - float32): %.4f" % (bf16["accuracy"] - float32["accuracy"]))
+print("Predicciones iguales: %.2f%% de %d ejemplos de test" % (100 * (float32["y_pred"] == bf16["y_pred"]).float().mean().item(), len(float32["y_gts"])))
+
+#mismo modelo (el de float32) explicado con y sin autocast: efecto de bf16 solo en la explicación
+expls_bf16, _, _ = predict_all(float32["model"], models.ExplainationGenerator(float32["model"]), explainloader, device, bf16=True)
+same_model = [spearmanr(a, b)[0] for a, b in zip(float32["expls"].numpy(), expls_bf16.detach().numpy())]
+print("Spearman medio de la relevancia por fila (mismo modelo, explicación bf16 vs float32): %.4f" % np.nanmean(same_model))
+ranking = spearmanr(float32["expls"].mean(dim=0).numpy(), bf16["expls"].mean(dim=0).numpy())[0]
+print("Spearman de la relevancia media por variable (modelo bf16 vs modelo float32): %.4f" % ranking)
@@ -6,6 +6,7 @@ from collections import namedtuple
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import StratifiedKFold
 import random
+import copy
 
 def data_split(X, y, nan_mask, indices):
     x_d = {
@@ -34,10 +35,14 @@ class Dataset(torch.utils.data.Dataset):
         self.dataCont = cont
         self.y_encoder = y_l_enc
         
-        self.cat = data.cat
-        self.cont = data.cont
-        self.cat_mask = data.cat_mask
-        self.cont_mask = data.cont_mask
+        #arrays base inmutables (compartidos entre vistas) + columnas activas; la eliminación de variables solo
+        #cambia cat_columns/cont_columns y las columnas se seleccionan al pedir los datos
+        self._cat = data.cat
+        self._cont = data.cont
+        self._cat_mask = data.cat_mask
+        self._cont_mask = data.cont_mask
+        self.cat_columns = list(range(data.cat.shape[1]))
+        self.cont_columns = list(range(data.cont.shape[1]))
         self.y = data.y
         self.num_classes = data.num_classes
         self.cls = data.cls
@@ -46,10 +51,147 @@ class Dataset(torch.utils.data.Dataset):
 
     def __len__(self):
         return len(self.y)
-    
+
+    def gather(self, array, columns):
+        if len(columns) == array.shape[1]:
+            return array
+        return array[:, columns]
+
+    @property
+    def cat(self):
+        return self.gather(self._cat, self.cat_columns)
+
+    @property
+    def cont(self):
+        return self.gather(self._cont, self.cont_columns)
+
+    @property
+    def cat_mask(self):
+        return self.gather(self._cat_mask, self.cat_columns)
+
+    @property
+    def cont_mask(self):
+        return self.gather(self._cont_mask, self.cont_columns)
+
+    def num_features(self):
+        return len(self.cat_columns) + len(self.cont_columns)
+
     def __getitem__(self, idx):
-        return np.concatenate((self.cls[idx], self.cat[idx])), self.cont[idx], self.y[idx], np.concatenate((self.cls_mask[idx], self.cat_mask[idx])), self.cont_mask[idx]
+        return np.concatenate((self.cls[idx], self._cat[idx, self.cat_columns])), self._cont[idx, self.cont_columns], self.y[idx], np.concatenate((self.cls_mask[idx], self._cat_mask[idx, self.cat_columns])), self._cont_mask[idx, self.cont_columns]
+
+    def __getstate__(self):
+        #los tensores cacheados se reconstruyen al cargar, no se guardan en el .pk
+        state = self.__dict__.copy()
+        state.pop("_tensors", None)
+        state.pop("_columns", None)
+        return state
+
+    def __setstate__(self, state):
+        if "cat_columns" not in state: #.pk guardados antes de las columnas activas
+            for name in ("cat", "cont", "cat_mask", "cont_mask"):
+                state["_" + name] = state.pop(name)
+            state["cat_columns"] = list(range(state["_cat"].shape[1]))
+            state["cont_columns"] = list(range(state["_cont"].shape[1]))
+        self.__dict__.update(state)
+
+    def view(self):
+        #copia ligera para otra pasada de eliminación de variables: comparte los arrays base (y sus tensores)
+        #y solo duplica las listas de columnas y nombres
+        ds = copy.copy(self)
+        ds.cat_columns = list(self.cat_columns)
+        ds.cont_columns = list(self.cont_columns)
+        ds.dataCat = list(self.dataCat)
+        ds.dataCont = list(self.dataCont)
+        ds.attribute_names = list(self.attribute_names)
+        return ds
+
+    def delete_feature(self, feature):
+        #feature: índice sin contar el CLS, primero las categóricas y luego las continuas
+        if feature < len(self.cat_columns):
+            self.cat_columns.pop(feature)
+            i = self.dataCat.pop(feature)
+        else:
+            self.cont_columns.pop(feature - len(self.cat_columns))
+            i = self.dataCont.pop(feature - len(self.cat_columns))
+        self.attribute_names.pop(self.attribute_names.index(i[1]))
+
+    def tensors(self):
+        #mismos cinco elementos que __getitem__ pero para todo el dataset y con todas las columnas base, ya
+        #concatenados (CLS + cat) y como tensores de torch. No dependen de las columnas activas, así que se crean una vez
+        if self.__dict__.get("_tensors") is None:
+            self._tensors = (torch.as_tensor(np.concatenate((self.cls, self._cat), axis=1)), torch.as_tensor(self._cont), torch.as_tensor(self.y),
+                             torch.as_tensor(np.concatenate((self.cls_mask, self._cat_mask), axis=1)), torch.as_tensor(self._cont_mask))
+        return self._tensors
+
+    def columns(self):
+        #índices de las columnas activas sobre los tensores base (None si están todas)
+        key = (tuple(self.cat_columns), tuple(self.cont_columns))
+        cache = self.__dict__.get("_columns")
+        if cache is None or cache[0] != key:
+            cat_idx = None if len(self.cat_columns) == self._cat.shape[1] else torch.tensor([0] + [c + 1 for c in self.cat_columns], dtype=torch.long)
+            cont_idx = None if len(self.cont_columns) == self._cont.shape[1] else torch.tensor(self.cont_columns, dtype=torch.long)
+            cache = self._columns = (key, (cat_idx, cont_idx))
+        return cache[1]
+
+    def batch(self, idx):
+        #un batch completo con un único indexado por tensor (sin trabajo por fila ni collate); las columnas
+        #eliminadas se quitan solo del batch
+        x_categ, x_cont, y, cat_mask, cont_mask = [t[idx] for t in self.tensors()]
+        cat_idx, cont_idx = self.columns()
+        if cat_idx is not None:
+            x_categ, cat_mask = x_categ[:, cat_idx], cat_mask[:, cat_idx]
+        if cont_idx is not None:
+            x_cont, cont_mask = x_cont[:, cont_idx], cont_mask[:, cont_idx]
+        return [x_categ, x_cont, y, cat_mask, cont_mask]
+
+
+class TensorLoader:
+    #sustituto de torch.utils.data.DataLoader para Dataset: mismos batches (x_categ, x_cont, y, cat_mask, con_mask)
+    #pero obtenidos con Dataset.batch, sin workers. Expone .dataset igual que DataLoader.
+    #indices: si se indica, solo se recorren esas filas (p. ej. una partición de validación)
+    def __init__(self, dataset, batch_size=1, shuffle=False, indices=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.indices = indices
+
+    def __len__(self):
+        n = len(self.dataset) if self.indices is None else len(self.indices)
+        return -(-n // self.batch_size)
+
+    def __iter__(self):
+        n = len(self.dataset) if self.indices is None else len(self.indices)
+        if self.shuffle:
+            order = torch.randperm(n)
+            if self.indices is not None:
+                order = self.indices[order]
+            for start in range(0, n, self.batch_size):
+                yield self.dataset.batch(order[start:start + self.batch_size])
+        else:
+            for start in range(0, n, self.batch_size):
+                if self.indices is None:
+                    yield self.dataset.batch(slice(start, start + self.batch_size))
+                else:
+                    yield self.dataset.batch(self.indices[start:start + self.batch_size])
+
+
+class ShardLoader:
+    #parte de cada batch de loader que le toca a un proceso (filas rank, rank + world_size, ...) en el
+    #entrenamiento distribuido; todos los procesos recorren los mismos batches en el mismo orden
+    def __init__(self, loader, rank, world_size):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.rank = rank
+        self.world_size = world_size
+        self.batch_rows = 0
+
+    def __len__(self):
+        return len(self.loader)
 
+    def __iter__(self):
+        for data in self.loader:
+            self.batch_rows = data[0].shape[0] #filas del batch completo, para escalar la loss
+            yield [t[self.rank::self.world_size] for t in data]
 
 def getDataFromDataset(dataset_openml, seed, task, k=5):
     X, y, categorical_indicator, attribute_names = dataset_openml.get_data(dataset_format="dataframe", target=dataset_openml.default_target_attribute)
@@ -2,14 +2,28 @@ import torch
 import time
 import os
 import torch.optim as optim
+import argparse
 import pandas as pd
 from torch import nn
 import random
 import torchmetrics
 import numpy as np
 import csv
+import copy
+import itertools
+import pickle
+import hashlib
+import multiprocessing
+import socket
+import warnings
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.nn.attention import sdpa_kernel, SDPBackend
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.preprocessing import MinMaxScaler
 import models
+from datasets.loadData import TensorLoader, ShardLoader
+from telemetry import NO_TELEMETRY
 import shap
 from openpyxl import Workbook, load_workbook
 
@@ -104,14 +118,14 @@ def predict_explain_models(model, X_train, X_test, y_test, device, rf):
     return expls, metric_value
 
 def join_cat_cont(trainloader, testloader):
-    if trainloader.dataset.cat.shape[1] > 0:
-        if trainloader.dataset.cont.shape[1] > 0:
+    if len(trainloader.dataset.cat_columns) > 0:
+        if len(trainloader.dataset.cont_columns) > 0:
             X_train = np.concatenate([trainloader.dataset.cat, trainloader.dataset.cont], axis=1)
             X_test = np.concatenate([testloader.dataset.cat, testloader.dataset.cont], axis=1)
         else:
             X_train = trainloader.dataset.cat
             X_test = testloader.dataset.cat
-    elif trainloader.dataset.cont.shape[1] > 0:
+    elif len(trainloader.dataset.cont_columns) > 0:
         X_train = trainloader.dataset.cont
         X_test = testloader.dataset.cont
     else:
@@ -123,37 +137,94 @@ def join_cat_cont(trainloader, testloader):
     return X_train, y_train, X_test, y_test
 
 def delete_feature(trainloader, testloader, feature_deleted):
-    if feature_deleted < trainloader.dataset.cat.shape[1]:
-        trainloader.dataset.cat = np.delete(trainloader.dataset.cat, feature_deleted, axis=1)
-        trainloader.dataset.cat_mask = np.delete(trainloader.dataset.cat_mask, feature_deleted, axis=1)
-        i = trainloader.dataset.dataCat.pop(feature_deleted)
-        trainloader.dataset.attribute_names.pop(trainloader.dataset.attribute_names.index(i[1]))
-        testloader.dataset.cat = np.delete(testloader.dataset.cat, feature_deleted, axis=1)
-        testloader.dataset.cat_mask = np.delete(testloader.dataset.cat_mask, feature_deleted, axis=1)
-        i = testloader.dataset.dataCat.pop(feature_deleted)
-        testloader.dataset.attribute_names.pop(testloader.dataset.attribute_names.index(i[1]))    
-    else:
-        trainloader.dataset.cont = np.delete(trainloader.dataset.cont, feature_deleted-trainloader.dataset.cat.shape[1], axis=1)
-        trainloader.dataset.cont_mask = np.delete(trainloader.dataset.cont_mask, feature_deleted-trainloader.dataset.cat.shape[1], axis=1)
-        i = trainloader.dataset.dataCont.pop(feature_deleted-trainloader.dataset.cat.shape[1])
-        trainloader.dataset.attribute_names.pop(trainloader.dataset.attribute_names.index(i[1]))
-        testloader.dataset.cont = np.delete(testloader.dataset.cont, feature_deleted-testloader.dataset.cat.shape[1], axis=1)
-        testloader.dataset.cont_mask = np.delete(testloader.dataset.cont_mask, feature_deleted-testloader.dataset.cat.shape[1], axis=1)
-        i = testloader.dataset.dataCont.pop(feature_deleted-testloader.dataset.cat.shape[1])
-        testloader.dataset.attribute_names.pop(testloader.dataset.attribute_names.index(i[1]))
-    
-    return trainloader, testloader, trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]  
-
-
-def cross_validation_process(trainloader, testloader, y_dim, opt, device, criterion):
-    cat_dims = [trainloader.dataset.dataCat[i][2] for i in range(len(trainloader.dataset.dataCat))] 
+    #solo se actualizan las columnas activas de cada dataset, los arrays no se copian
+    trainloader.dataset.delete_feature(feature_deleted)
+    testloader.dataset.delete_feature(feature_deleted)
+    return trainloader, testloader, trainloader.dataset.num_features()
+
+
+def base_parser():
+    #opciones comunes a main.py y a los scripts de benchmark/informe (se usa como parents de su ArgumentParser)
+    parser = argparse.ArgumentParser(add_help=False)
+
+    # Parámetros obligatorios
+    parser.add_argument('--dset_id', required=True, type=int)
+    parser.add_argument('--task', required=True, type=str,choices = ['binary','multiclass','regression'])
+
+    # Parámetros de la ejecución
+    parser.add_argument('--epochs', default=100, type=int)
+    parser.add_argument('--batchsize', default=256, type=int)
+    parser.add_argument('--optimizer', default='AdamW', type=str,choices = ['AdamW','Adam','SGD'])
+    parser.add_argument('--scheduler', default='cosine', type=str,choices = ['cosine','linear'])
+    parser.add_argument('--lr', default=0.0001, type=float)
+    parser.add_argument('--savedatasetroot', default=os.path.relpath('./datasets/datasets_prepo'), type=str)
+    parser.add_argument('--set_seed', default= 1 , type=int)
+
+    # Parámetros del Transformer
+    parser.add_argument('--transformer_depth', default=6, type=int)
+    parser.add_argument('--attention_heads', default=8, type=int)
+    parser.add_argument('--attention_dropout', default=0.1, type=float)
+    parser.add_argument('--attentiontype', default='colrow', type=str, choices = ['col','colrow','row','justmlp','attn','attnmlp']) #TODO: revisar
+    parser.add_argument('--ff_dropout', default=0.1, type=float)
+    parser.add_argument('--row_attention_budget', default=None, type=float) #MB máximos para los scores de la atención entre filas (por bloques)
+    parser.add_argument('--row_attention_topk', default=None, type=int) #si se indica, cada fila solo atiende a sus k vecinas más parecidas
+
+    # Parámetros del modelo SAINT
+    parser.add_argument('--embedding_size', default=32, type=int)
+    parser.add_argument('--cont_embeddings', default='MLP', type=str,choices = ['MLP','Noemb','pos_singleMLP'])
+    parser.add_argument('--final_mlp_style', default='common', type=str,choices = ['common','sep'])
+    return parser
+
+
+def adjust_options(opt, nfeat):
+    #ajustes de tamaño del modelo según el número de variables y el tipo de atención
+    if (nfeat + 1) > 100:
+        opt.embedding_size = min(8,opt.embedding_size)
+        opt.batchsize = min(64, opt.batchsize)
+    if opt.attentiontype != 'col':
+        opt.transformer_depth = 1
+        opt.attention_heads = min(4,opt.attention_heads)
+        opt.attention_dropout = 0.8
+        opt.embedding_size = min(32,opt.embedding_size)
+        opt.ff_dropout = 0.8
+    return opt
+
+
+def dataset_path(root, task, dset_id):
+    return "." + os.sep + root + os.sep + task + os.sep + str(dset_id)
+
+
+def load_folds(path, folds=None, splits=("train", "test")):
+    #particiones guardadas por main.py --typeExecution loadData: {"train": {"fold0": ..., ...}, "test": {...}}.
+    #folds: índices de las particiones que se cargan (por defecto todas)
+    folders = {}
+    for split in splits:
+        folders[split] = {}
+        for file in os.scandir(path + os.sep + split):
+            name = file.name.split(".")[0]
+            if folds is None or name in ["fold" + str(k) for k in folds]:
+                with open(file.path, "rb") as ds_file:
+                    folders[split][name] = pickle.load(ds_file)
+    return folders
+
+
+def load_fold(opt, splits=("train", "test")):
+    #partición opt.fold del dataset opt.dset_id guardado en opt.savedatasetroot: {"train": ..., "test": ...}
+    folders = load_folds(dataset_path(opt.savedatasetroot, opt.task, opt.dset_id), [opt.fold], splits)
+    return {split: folders[split]["fold" + str(opt.fold)] for split in splits}
+
+
+def create_model(dataset, y_dim, opt, pretraining_heads=False):
+    #pretraining_heads: crea también las cabezas de preentrenamiento/reconstrucción (SAINT.forward); el entrenamiento
+    #supervisado solo usa mlpfory. Se deciden aquí, antes de crear el optimizador
+    cat_dims = [dataset.dataCat[i][2] for i in range(len(dataset.dataCat))] 
     cat_dims = np.append(np.array([1]),np.array(cat_dims)).astype(int) #Appending 1 for CLS token, this is later used to generate embeddings.
-    nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]  
+    nfeat = dataset.num_features()
 
     model = models.SAINT(
         num_features = nfeat + 1,
         categories = tuple(cat_dims), 
-        num_continuous = trainloader.dataset.cont.shape[1],       
+        num_continuous = len(dataset.cont_columns),       
         dim = opt.embedding_size,                           
         dim_out = 1,                       
         depth = opt.transformer_depth,                       
@@ -164,27 +235,219 @@ def cross_validation_process(trainloader, testloader, y_dim, opt, device, criter
         cont_embeddings = opt.cont_embeddings,
         attentiontype = opt.attentiontype,
         final_mlp_style = opt.final_mlp_style,
-        y_dim = y_dim
+        y_dim = y_dim,
+        row_memory_budget = opt.row_attention_budget,
+        row_topk = opt.row_attention_topk,
+        pretraining_heads = pretraining_heads
     )
-    
+    return model
+
+
+def remove_slice(t, axis, start, length):
+    return torch.cat((t.narrow(axis, 0, start), t.narrow(axis, start + length, t.shape[axis] - start - length)), dim=axis)
+
+
+def warm_start(model, previous, feature_deleted):
+    #copia en model (una variable menos) los pesos de previous, el modelo del paso anterior de la eliminación
+    #recursiva, quitando lo que corresponde a la variable feature_deleted (índice sin contar el CLS, como en delete_feature).
+    #Lo que no depende del número de variables (atención entre columnas, mlpfory...) se copia tal cual
+    token = feature_deleted + 1
+    dim = previous.dim
+    is_cat = token < previous.num_categories
+    cont = token - previous.num_categories
+    nfeats_old = previous.num_categories + previous.num_continuous
+
+    state = model.state_dict()
+    for key, old in previous.named_parameters():
+        if key not in state:
+            continue
+        old = old.detach()
+        if key == 'embeds.weight' and is_cat:
+            old = remove_slice(old, 0, int(previous.categories_offset[token]), int(previous.categories[token]))
+        elif key == 'mask_embeds_cat.weight' and is_cat:
+            old = remove_slice(old, 0, 2 * token, 2)
+        elif key == 'mask_embeds_cont.weight' and not is_cat:
+            old = remove_slice(old, 0, 2 * cont, 2)
+        elif key == 'pos_encodings.weight':
+            old = remove_slice(old, 0, token, 1)
+        elif (key.startswith('norm.') or (key.startswith('simple_MLP.') and previous.cont_embeddings == 'MLP')) and not is_cat:
+            old = remove_slice(old, 0, cont, 1)
+        elif key.startswith('transformer.'):
+            #bloques de atención entre filas: los ejes de tamaño dim*nfeats van por variable ('b n d -> 1 b (n d)');
+            #las capas ocultas de FeedForward (dim*nfeats*mult, y el doble antes de GEGLU) no tienen correspondencia
+            #con las variables y se recortan quedándose con las primeras unidades de cada mitad
+            for axis, size in enumerate(old.shape):
+                if size == state[key].shape[axis]:
+                    continue
+                if size == dim * nfeats_old:
+                    old = remove_slice(old, axis, token * dim, dim)
+                elif axis == 0 and key.endswith(('net.0.weight', 'net.0.bias')): #salida (x, gates) de GEGLU
+                    half, new_half = size // 2, state[key].shape[axis] // 2
+                    old = torch.cat((old.narrow(axis, 0, new_half), old.narrow(axis, half, new_half)), dim=axis)
+                else:
+                    old = old.narrow(axis, 0, state[key].shape[axis])
+        if old.shape == state[key].shape:
+            state[key] = old
+    model.load_state_dict(state)
+    return model
+
+
+def cross_validation_process(trainloader, testloader, y_dim, opt, device, criterion, previous=None, feature_deleted=None, telemetry=NO_TELEMETRY):
+    #previous: modelo del paso anterior de la eliminación recursiva (con feature_deleted ya quitada de los datos);
+    #si se indica, el nuevo modelo parte de sus pesos y solo se ajusta opt.warm_start_epochs.
+    #telemetry: telemetry.Telemetry para medir el paso (ver --telemetry en main.py)
+    #con warm start el modelo tiene las mismas cabezas que el del paso anterior
+    model = create_model(trainloader.dataset, y_dim, opt, previous is not None and previous.pretraining_heads)
+    epochs = opt.epochs
+    if previous is not None:
+        warm_start(model, previous, feature_deleted)
+        epochs = opt.warm_start_epochs
     model.to(device)
 
-    optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, opt.epochs, opt.lr)
+    optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, epochs, opt.lr)
 
     
     #model = train(model, trainloader, opt.task, 3, device, criterion, opt.optimizer, optimizer, scheduler)
-    model = train(model, trainloader, opt.task, opt.epochs, device, criterion, opt.optimizer, optimizer, scheduler)
+    fitloader, validloader = trainloader, None
+    if opt.validation_split > 0:
+        #la validación sale de la propia partición de train; la explicación se sigue calculando con todo el train
+        dataset = trainloader.dataset
+        order = torch.randperm(len(dataset))
+        nvalid = max(1, int(len(dataset) * opt.validation_split))
+        fitloader = TensorLoader(dataset, batch_size=trainloader.batch_size, shuffle=True, indices=order[nvalid:])
+        validloader = TensorLoader(dataset, batch_size=nvalid, shuffle=False, indices=order[:nvalid])
+    with telemetry.phase("train"):
+        if opt.ddp_workers > 1 and device.type == 'cpu':
+            model = train_distributed(model, fitloader, opt.task, epochs, criterion, opt.optimizer, optimizer, scheduler, validloader, opt.patience, opt.ddp_workers, opt.bf16, telemetry)
+        else:
+            model = train(model, fitloader, opt.task, epochs, device, criterion, opt.optimizer, optimizer, scheduler, validloader, opt.patience, telemetry, bf16=opt.bf16)
     print("\tModelo entrenado, calculando métricas...")
     
-    explainator = models.ExplainationGenerator(model)
-    expls, y_pred, y_gts = predict_all(model, explainator, testloader, device)
+    #la explicación del test no se usa, para la métrica basta con predecir (camino rápido, sin relprop)
+    with telemetry.phase("predict"):
+        y_pred, y_gts = predict(model, testloader, device, opt.bf16)
     metric, metric_name = create_metric(opt.task, y_dim, device)
     metric_value = metric(torch.squeeze(y_pred), torch.squeeze(y_gts))
     print("\t" + metric_name + ": " + str(torch.Tensor.numpy(metric_value.cpu())))
 
     #TODO: la métrica de accuracy se saca con testloader pero la explicación se saca con trainloader
-    expls, y_pred, y_gts = predict_all(model, explainator, trainloader, device)
-    return expls, metric_value
+    if opt.explainer == 'rollout':
+        explainator = models.RolloutExplainer(model)
+    else:
+        explainator = models.ExplainationGenerator(model, opt.lean_explanation)
+    with telemetry.phase("explain"):
+        expls, y_pred, y_gts = predict_all(model, explainator, trainloader, device, telemetry, opt.bf16, opt.explain_batchsize)
+    return expls, metric_value, model
+
+
+def seed_fold(seed):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+fold_function = None #función de la partición que heredan los procesos hijos (fork)
+
+def run_fold(k, seed, threads):
+    torch.set_num_threads(threads)
+    seed_fold(seed + k)
+    return fold_function(k)
+
+
+def run_folds(function, num_folders, workers, seed, device):
+    #ejecuta function(k) para cada partición y devuelve sus resultados en orden. Cada partición se siembra con
+    #seed + k, así que el resultado es el mismo con cualquier número de procesos. Con workers > 1 las particiones
+    #van en procesos hijos (fork, para no reejecutar main.py) que se reparten los núcleos con torch.set_num_threads
+    global fold_function
+    if workers <= 1 or num_folders <= 1:
+        results = []
+        for k in range(num_folders):
+            seed_fold(seed + k)
+            results.append(function(k))
+        return results
+    if device.type != 'cpu':
+        print("ERROR - las particiones en paralelo solo están soportadas en CPU, se ejecutan en secuencia")
+        return run_folds(function, num_folders, 1, seed, device)
+
+    workers = min(workers, num_folders)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    fold_function = function
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            return list(executor.map(run_fold, range(num_folders), [seed] * num_folders, [threads] * num_folders))
+    finally:
+        fold_function = None
+
+
+def run_config(opt):
+    #parámetros que determinan los resultados (no cambian al reanudar con otro número de procesos)
+    return {key: value for key, value in vars(opt).items() if key not in ('typeExecution', 'fold_workers', 'telemetry', 'resume')}
+
+
+def data_fingerprint(datasets):
+    #forma y hash de los datos completos (_cat, _cont, y) de cada dataset: un checkpoint hecho con otros datos
+    #(p. ej. tras regenerar datasets_prepo) no se reutiliza
+    fingerprint = []
+    for dataset in datasets:
+        digest = hashlib.sha1()
+        for array in (dataset._cat, dataset._cont, dataset.y):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        fingerprint.append((dataset._cat.shape, dataset._cont.shape, digest.hexdigest()))
+    return fingerprint
+
+
+def load_steps(root, family, k, opt, datasets):
+    #pasos ya hechos de la eliminación recursiva para (family, partición k); solo con --resume. Si el checkpoint
+    #es de otra configuración o de otros datos (datasets: train y test de la partición) se ignora y se empieza de cero
+    path = root + os.sep + family + "_fold" + str(k) + ".pk"
+    config = run_config(opt)
+    config["data"] = data_fingerprint(datasets)
+    steps = []
+    if opt.resume and os.path.exists(path):
+        with open(path, "rb") as file:
+            saved = pickle.load(file)
+        if saved["config"] == config:
+            steps = saved["steps"]
+            print("\tReanudando " + family + " partición " + str(k) + ": " + str(len(steps)) + " pasos ya calculados")
+        else:
+            print("\tAVISO - el checkpoint " + path + " es de otra configuración o de otros datos, se ignora")
+    return steps, (path, config)
+
+
+def save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, model):
+    #guarda en disco el resultado del paso (accuracy, relevancias y variable eliminada) junto con el estado de los
+    #generadores aleatorios, para que al reanudar los pasos siguientes salgan igual que sin interrupción.
+    #model: solo con warm start, y solo se conserva el del último paso
+    path, config = checkpoint
+    for step in steps:
+        step["model"] = None
+    steps.append({
+        "metric": float(metric_value),
+        "relevance": {key: float(value) for key, value in expl_for_save.items()},
+        "feature_deleted": int(feature_deleted),
+        "model": None if model is None else {key: value.detach().cpu() for key, value in model.state_dict().items()},
+        "rng": (torch.get_rng_state(), torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None, np.random.get_state(), random.getstate())
+    })
+    with open(path + ".tmp", "wb") as file:
+        pickle.dump({"config": config, "steps": steps}, file)
+    os.replace(path + ".tmp", path) #el checkpoint anterior sigue siendo válido si se corta a mitad de escritura
+
+
+def resume_step(step, dataset, y_dim, opt):
+    #devuelve lo mismo que el paso original y deja los generadores aleatorios como estaban al terminarlo
+    model = None
+    if step["model"] is not None:
+        model = create_model(dataset, y_dim, opt, any(key.startswith('pt_mlp.') for key in step["model"]))
+        model.load_state_dict(step["model"])
+    #después de crear el modelo, que también consume números aleatorios al inicializarse
+    torch_state, cuda_state, np_state, random_state = step["rng"]
+    torch.set_rng_state(torch_state)
+    if cuda_state is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(cuda_state)
+    np.random.set_state(np_state)
+    random.setstate(random_state)
+    print("\t\tPaso ya calculado, eliminamos la variable con id: " + str(step["feature_deleted"]))
+    return np.float64(step["metric"]), step["relevance"], step["feature_deleted"], model
 
 
 """def drop_row_column(tensor, index, row_colum):
@@ -197,26 +460,25 @@ def cross_validation_process(trainloader, testloader, y_dim, opt, device, criter
 
 
 def embed_data_mask(x_categ, x_cont, cat_mask, con_mask,model):#,vision_dset=False):
-    device = x_cont.device
     x_categ = x_categ + model.categories_offset.type_as(x_categ)
     x_categ_enc = model.embeds(x_categ)
-    n1,n2 = x_cont.shape
-    _, n3 = x_categ.shape
     if model.cont_embeddings == 'MLP':
-        x_cont_enc = torch.empty(n1,n2, model.dim)
-        for i in range(model.num_continuous):
-            x_cont_enc[:,i,:] = model.simple_MLP[i](x_cont[:,i])
+        x_cont_enc = model.simple_MLP(x_cont) #todas las columnas a la vez, ya en el device del modelo
+    elif model.cont_embeddings == 'pos_singleMLP':
+        #una única MLP compartida por todas las columnas (una sola llamada sobre (b, n, 1)); la posición de cada
+        #variable continua la aporta pos_encodings, que va detrás de las categóricas
+        x_cont_enc = model.simple_MLP[0](x_cont.unsqueeze(-1))
+        x_cont_enc = x_cont_enc + model.pos_encodings.weight[model.num_categories:]
     else:
         raise Exception('This case should not work!')    
 
-    x_cont_enc = x_cont_enc.to(device)
     cat_mask_temp = cat_mask + model.cat_mask_offset.type_as(cat_mask)
     con_mask_temp = con_mask + model.con_mask_offset.type_as(con_mask)
 
     cat_mask_temp = model.mask_embeds_cat(cat_mask_temp)
     con_mask_temp = model.mask_embeds_cont(con_mask_temp)
-    x_categ_enc[cat_mask == 0] = cat_mask_temp[cat_mask == 0]
-    x_cont_enc[con_mask == 0] = con_mask_temp[con_mask == 0]
+    x_categ_enc = torch.where((cat_mask == 0).unsqueeze(-1), cat_mask_temp, x_categ_enc)
+    x_cont_enc = torch.where((con_mask == 0).unsqueeze(-1), con_mask_temp, x_cont_enc)
 
     return x_categ, x_categ_enc, x_cont_enc
 
@@ -268,29 +530,214 @@ def create_metric(task, num_classes, device):
     return metric, metric_name
 
 
-def train(model, trainloader, task, epochs, device, criterion, optimizer_type, optimizer, scheduler):
+def validation_loss(model, validloader, task, device, criterion, bf16=False):
+    model.eval()
+    loss, n = 0.0, 0
+    with torch.no_grad():
+        for i, data in enumerate(validloader, 0):
+            x_categ, x_cont, y_gts, cat_mask, con_mask = data[0].to(device), data[1].to(device),data[2].to(device),data[3].to(device),data[4].to(device)
+            _ , x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, model)
+            with autocast(device, bf16):
+                reps = model.transformer(x_categ_enc, x_cont_enc, cls_only=True)
+            y_outs = model.mlpfory(reps[:,0,:].float())
+            if task == 'regression':
+                loss += criterion(y_outs,y_gts).item() * y_gts.shape[0]
+            else:
+                loss += criterion(y_outs,y_gts.squeeze(1)).item() * y_gts.shape[0]
+            n += y_gts.shape[0]
+    return loss / n
+
+
+def train(model, trainloader, task, epochs, device, criterion, optimizer_type, optimizer, scheduler, validloader=None, patience=None, telemetry=NO_TELEMETRY, ddp=None, bf16=False):
+    #con validloader se guarda el estado con menor pérdida de validación y se restaura al final; con patience
+    #además se para si la pérdida de validación no mejora en patience epochs seguidas.
+    #ddp: SAINTInference del modelo envuelto en DistributedDataParallel (ver train_distributed); trainloader es
+    #entonces un ShardLoader con la parte de cada batch de este proceso.
+    #bf16: el transformer se ejecuta con autocast a bfloat16 (ver autocast)
+    best_loss, best_state, bad_epochs = None, None, 0
     for epoch in range(epochs):
-        if epoch % 20 == 0: print("\tEpoch " + str(epoch) + ": ")
         model.train()
         running_loss = 0.0
+        telemetry.start(epoch=epoch)
         for i, data in enumerate(trainloader, 0):
             optimizer.zero_grad()
 
             x_categ, x_cont, y_gts, cat_mask, con_mask = data[0].to(device), data[1].to(device),data[2].to(device),data[3].to(device),data[4].to(device)
-            _ , x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, model)      
-            reps = model.transformer(x_categ_enc, x_cont_enc)
-            y_reps = reps[:,0,:]
-            y_outs = model.mlpfory(y_reps)
+            telemetry.lap("loader")
+            telemetry.samples(x_categ.shape[0] if ddp is None else trainloader.batch_rows) #con DDP, filas del batch completo
+            if ddp is None:
+                _ , x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, model)      
+                telemetry.lap("embed")
+                with autocast(device, bf16):
+                    reps = model.transformer(x_categ_enc, x_cont_enc, cls_only=True)
+                telemetry.lap("transformer")
+                y_reps = reps[:,0,:].float()
+                y_outs = model.mlpfory(y_reps)
+                telemetry.lap("mlpfory")
+            else:
+                with autocast(device, bf16):
+                    y_outs = ddp(x_categ, x_cont, cat_mask, con_mask).float() #mismo cálculo, pasando por DDP para sincronizar gradientes
+                telemetry.lap("forward")
 
-            if task == 'regression':
+            if y_outs.shape[0] == 0: #batch con menos filas que procesos: este no aporta, pero tiene que hacer backward
+                loss = y_outs.sum()
+            elif task == 'regression':
                 loss = criterion(y_outs,y_gts) 
             else:
-                loss = criterion(y_outs,y_gts.squeeze()) 
+                loss = criterion(y_outs,y_gts.squeeze(1)) 
+            if ddp is not None:
+                #DDP promedia los gradientes entre procesos; así el resultado es el gradiente de la media del batch completo
+                loss = loss * (y_outs.shape[0] * trainloader.world_size / trainloader.batch_rows)
             loss.backward()
+            telemetry.lap("backward")
             optimizer.step()
             if optimizer_type == 'SGD':
                 scheduler.step()
             running_loss += loss.item()
+            telemetry.lap("optimizer")
+
+        if ddp is not None:
+            #la suma de las losses escaladas de todos los procesos / world_size es la loss media del batch completo
+            running_loss = torch.tensor(running_loss)
+            dist.all_reduce(running_loss)
+            running_loss = running_loss.item() / trainloader.world_size
+        verbose = ddp is None or dist.get_rank() == 0
+        if validloader is None:
+            telemetry.end_epoch(loss=running_loss / (i + 1))
+            if epoch % 20 == 0 and verbose: print("\tEpoch " + str(epoch) + ": loss " + str(running_loss / (i + 1)))
+            continue
+        valid_loss = validation_loss(model, validloader, task, device, criterion, bf16)
+        telemetry.lap("validation")
+        telemetry.end_epoch(loss=running_loss / (i + 1), valid_loss=valid_loss)
+        if epoch % 20 == 0 and verbose: print("\tEpoch " + str(epoch) + ": loss " + str(running_loss / (i + 1)) + ", loss validación " + str(valid_loss))
+        if best_loss is None or valid_loss < best_loss:
+            best_loss, bad_epochs = valid_loss, 0
+            best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        else:
+            bad_epochs += 1
+            if patience is not None and bad_epochs >= patience:
+                if verbose: print("\tParada temprana en la epoch " + str(epoch) + " (mejor loss validación " + str(best_loss) + ")")
+                break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    return model
+
+
+def train_folds(fold_models, trainloaders, task, epochs, device, criterion, optimizer_type, scheduler_type, lr):
+    #entrena a la vez los modelos de varias particiones (misma arquitectura) con torch.func: los parámetros se apilan
+    #(stack_module_state) y el forward de todos es un único vmap de functional_call, cada modelo con sus propios
+    #batches. El gradiente de la suma de las losses da en cada parte de los parámetros apilados el de su modelo, y cada
+    #partición tiene su propio optimizador (sobre vistas de su parte), así que equivale a optimizar cada modelo por
+    #separado. Los batches de distinto tamaño se rellenan: las filas de relleno no cuentan en la loss ni se atienden en
+    #la atención entre filas. Si una partición tiene menos batches que otra, en los que le faltan no da ningún paso
+    #(ni momento, ni weight decay, ni avance de su número de pasos o de su scheduler).
+    #No hay validación/parada temprana; los pesos entrenados se copian en fold_models
+    inferences = [models.SAINTInference(model).to(device).train() for model in fold_models]
+    params, buffers = torch.func.stack_module_state(inferences)
+    params = {name: nn.Parameter(value) for name, value in params.items()}
+    base = copy.deepcopy(inferences[0]).to("meta")
+
+    def forward(params, buffers, x_categ, x_cont, cat_mask, con_mask, row_mask):
+        return torch.func.functional_call(base, (params, buffers), (x_categ, x_cont, cat_mask, con_mask, row_mask))
+    vforward = torch.func.vmap(forward, randomness="different") #dropout distinto en cada modelo
+
+    #parámetros de cada partición: vistas (comparten memoria) de su parte de los apilados
+    fold_params = [[nn.Parameter(value.detach()[k]) for value in params.values()] for k in range(len(fold_models))]
+    optimizers = [select_optimizer(nn.ParameterList(fold_param), optimizer_type, scheduler_type, epochs, lr) for fold_param in fold_params]
+    row_criterion = copy.copy(criterion)
+    row_criterion.reduction = 'none'
+    for epoch in range(epochs):
+        running_loss = torch.zeros(len(fold_models))
+        for i, batches in enumerate(itertools.zip_longest(*trainloaders), 0):
+            for value in params.values():
+                value.grad = None
+            rows = max(data[0].shape[0] for data in batches if data is not None)
+            stacked, weights = [], []
+            for data in batches:
+                if data is None: #partición sin más batches en esta epoch
+                    data, n = [t[:1] for t in next(other for other in batches if other is not None)], 0
+                else:
+                    n = data[0].shape[0]
+                pad = torch.zeros(rows, dtype=torch.long)
+                pad[:n] = torch.arange(n)
+                stacked.append([t[pad] for t in data])
+                weights.append(torch.arange(rows) < n)
+            x_categ, x_cont, y_gts, cat_mask, con_mask = [torch.stack(t).to(device) for t in zip(*stacked)]
+            weights = torch.stack(weights).to(device)
+            row_mask = weights.clone()
+            row_mask[:, 0] = True #al menos una fila atendible aunque el modelo no tenga batch
+
+            #scaled_dot_product_attention no tiene regla de vmap (iría modelo a modelo); la versión MATH se descompone
+            #en matmul + softmax, que sí se vectorizan
+            with sdpa_kernel(SDPBackend.MATH):
+                y_outs = vforward(params, buffers, x_categ, x_cont, cat_mask, con_mask, row_mask)
+            if task == 'regression':
+                losses = row_criterion(y_outs, y_gts).sum(-1)
+            else:
+                losses = row_criterion(y_outs.flatten(0, 1), y_gts.flatten()).view(weights.shape)
+            fold_losses = (losses * weights).sum(1) / weights.sum(1).clamp(min=1)
+            fold_losses.sum().backward()
+            for k, (optimizer, scheduler) in enumerate(optimizers):
+                if batches[k] is None:
+                    continue
+                for fold_param, value in zip(fold_params[k], params.values()):
+                    fold_param.grad = None if value.grad is None else value.grad[k] #None: no interviene en el entrenamiento supervisado
+                optimizer.step()
+                if optimizer_type == 'SGD':
+                    scheduler.step()
+            running_loss += fold_losses.detach().cpu()
+        if epoch % 20 == 0: print("\tEpoch " + str(epoch) + ": loss " + str((running_loss / (i + 1)).tolist()))
+
+    with torch.no_grad():
+        for k, inference in enumerate(inferences):
+            for name, parameter in inference.named_parameters():
+                parameter.copy_(params[name][k])
+    return fold_models
+
+
+def train_rank(rank, world_size, port, shared_state, epochs_queue, model, trainloader, task, epochs, criterion, optimizer_type, optimizer, scheduler, validloader, patience, telemetry, bf16):
+    telemetry = telemetry if rank == 0 else NO_TELEMETRY
+    try:
+        os.environ["MASTER_ADDR"] = "127.0.0.1"
+        os.environ["MASTER_PORT"] = str(port)
+        dist.init_process_group("gloo", rank=rank, world_size=world_size)
+        #los hilos del proceso que lanza el entrenamiento (todos los núcleos, o su parte con --fold_workers) se reparten
+        torch.set_num_threads(max(1, torch.get_num_threads() // world_size))
+        #DDP avisa de que el gradiente de los pesos de batched_MLP no tiene la misma disposición que su bucket (solo afecta a la velocidad)
+        warnings.filterwarnings("ignore", message="Grad strides do not match bucket view strides")
+        #hay parámetros que no intervienen en el entrenamiento supervisado (query/key/value, single_mask...)
+        ddp = DistributedDataParallel(models.SAINTInference(model), find_unused_parameters=True)
+        #grupo aparte para juntar las filas en la atención entre filas, sin mezclarse con las comunicaciones de DDP
+        row_group = dist.new_group(backend="gloo")
+        with model.shared_rows(row_group):
+            model = train(model, ShardLoader(trainloader, rank, world_size), task, epochs, torch.device("cpu"), criterion, optimizer_type, optimizer, scheduler, validloader, patience, telemetry, ddp=ddp, bf16=bf16)
+        if rank == 0:
+            for key, value in model.state_dict().items():
+                shared_state[key].copy_(value)
+        dist.destroy_process_group()
+    finally:
+        if rank == 0: #también si falla, para que train_distributed no se quede esperando
+            epochs_queue.put(telemetry.export_epochs())
+
+
+def train_distributed(model, trainloader, task, epochs, criterion, optimizer_type, optimizer, scheduler, validloader=None, patience=None, world_size=2, bf16=False, telemetry=NO_TELEMETRY):
+    #entrenamiento data-parallel en world_size procesos locales (gloo, solo CPU). Todos recorren los mismos batches
+    #y cada uno calcula su parte de las filas; en la atención entre filas las keys/values se juntan entre procesos
+    #(SAINT.shared_rows), así que con dropout 0 el modelo es el mismo que con train() para cualquier attentiontype.
+    #Los procesos se crean con fork (heredan modelo, optimizador y loaders) y el proceso 0 deja el resultado en
+    #memoria compartida y sus epochs de telemetría en una cola
+    shared_state = {key: value.detach().clone().share_memory_() for key, value in model.state_dict().items()}
+    epochs_queue = multiprocessing.get_context("fork").SimpleQueue()
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    context = torch.multiprocessing.start_processes(train_rank, args=(world_size, port, shared_state, epochs_queue, model, trainloader, task, epochs, criterion, optimizer_type, optimizer, scheduler, validloader, patience, telemetry, bf16),
+                                                    nprocs=world_size, join=False, start_method="fork")
+    telemetry.import_epochs(epochs_queue.get()) #antes de esperar a los procesos, para que el 0 no se bloquee escribiendo en la cola
+    while not context.join():
+        pass
+    model.load_state_dict(shared_state)
     return model
 
 
@@ -451,25 +898,58 @@ def write_metrics_file(file_name, mode, model_name, num_examples, cat_names, con
     file.close()
 
 
-def predict_all(model, explainator, dataset, device):
+def predict(model, dataset, device, bf16=False):
+    #solo predicciones: sin gradientes la atención usa el camino rápido (QKV fusionado + scaled_dot_product_attention)
     model.eval()
-    for i, data in enumerate(dataset, 0):
-        x_categ, x_cont, y_gts, cat_mask, con_mask = data[0].to(device), data[1].to(device),data[2].to(device),data[3].to(device),data[4].to(device)
-        _ , x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, model)
-        
-        if explainator == None:
-            reps = model.transformer(x_categ_enc , x_cont_enc)
-            y_reps = reps[:,0,:]
-            output = model.mlpfory(y_reps) 
-            print("ERROR - No se ha pasado un explicador para explicar el modelo")
-        else:
-            expls, outputs = explainator.generateExplanation_all(x_categ_enc, x_cont_enc, device)
-            expls = expls[:, 1:]
-            y_pred = torch.from_numpy(np.argmax(outputs.cpu().data.numpy(), axis=1)).to(device)
-            y_pred = torch.unsqueeze(y_pred, dim=1)
-            return expls, y_pred, y_gts
+    y_preds, y_gts_all = [], []
+    with torch.no_grad():
+        for i, data in enumerate(dataset, 0):
+            x_categ, x_cont, y_gts, cat_mask, con_mask = data[0].to(device), data[1].to(device),data[2].to(device),data[3].to(device),data[4].to(device)
+            _ , x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, model)
+            with autocast(device, bf16):
+                reps = model.transformer(x_categ_enc, x_cont_enc, cls_only=True)
+            y_outs = model.mlpfory(reps[:,0,:].float())
+            y_preds.append(torch.argmax(y_outs, dim=1, keepdim=True))
+            y_gts_all.append(y_gts)
+    return torch.cat(y_preds), torch.cat(y_gts_all)
+
+
+def explain_batches(model, explainator, dataset, device, chunk_size=None, telemetry=NO_TELEMETRY, bf16=False):
+    #recorre todo el loader y explica cada batch por separado (en trozos de como mucho chunk_size filas si se indica);
+    #devuelve según avanza (relevancia, predicción, etiquetas) de cada trozo ya en CPU, así la memoria de la
+    #relprop depende del tamaño del trozo y no del de la partición
+    model.eval()
+    for data in dataset:
+        size = data[0].shape[0] if chunk_size is None else chunk_size
+        for start in range(0, data[0].shape[0], size):
+            x_categ, x_cont, y_gts, cat_mask, con_mask = [t[start:start + size].to(device) for t in data]
+            telemetry.lap("loader")
+            telemetry.samples(x_categ.shape[0])
+            _ , x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, model)
+            telemetry.lap("embed")
+            expls, outputs = explainator.generateExplanation_all(x_categ_enc, x_cont_enc, device, bf16)
+            telemetry.lap("explanation")
+            y_pred = torch.argmax(outputs.detach(), dim=1, keepdim=True)
+            yield expls[:, 1:].detach().cpu(), y_pred.cpu(), y_gts.cpu()
+
+
+def predict_all(model, explainator, dataset, device, telemetry=NO_TELEMETRY, bf16=False, chunk_size=None):
+    #explicación (sin el CLS), predicción y etiquetas de todas las filas del loader (ver explain_batches)
+    if explainator == None:
+        print("ERROR - No se ha pasado un explicador para explicar el modelo")
+        return None, None, None
+    telemetry.start()
+    expls, y_pred, y_gts = map(torch.cat, zip(*explain_batches(model, explainator, dataset, device, chunk_size, telemetry, bf16)))
+    telemetry.end_explain()
+    return expls.to(device), y_pred.to(device), y_gts.to(device)
 
      
+def autocast(device, bf16):
+    #precisión mixta bfloat16: las matmuls (Linear, MatMul, atención) van en bf16; softmax, LayerNorm y gelu se
+    #quedan en float32 por la política de autocast, y relprop trabaja en float32 (forward_hook guarda X en float32)
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16)
+
+
 def safe_divide(a, b):
     den = b.clamp(min=1e-9) + b.clamp(max=1e-9)
     den = den + den.eq(0).type(den.type()) * 1e-9
@@ -477,14 +957,17 @@ def safe_divide(a, b):
 
 
 def forward_hook(self, input, output):
+    if not self.relprop_enabled:
+        return
     if type(input[0]) in (list, tuple):
         self.X = []
         for i in input[0]:
-            x = i.detach()
+            x = i.detach().float() #con autocast la entrada puede venir en bf16
             x.requires_grad = True
             self.X.append(x)
     else:
-        self.X = input[0].detach()
+        self.X = input[0].detach().float()
         self.X.requires_grad = True
 
-    self.Y = output
\ No newline at end of file
+    if not self.relprop_lean: #la salida mantiene vivo el grafo del forward
+        self.Y = output
\ No newline at end of file
@@ -5,47 +5,37 @@ import torch
 import gc
 import numpy as np
 import pandas as pd
-from torch.utils.data import DataLoader
 import pickle
 from sklearn.preprocessing import MinMaxScaler
-import copy
 
-from functions import select_criterion, cross_validation_process, delete_feature, join_cat_cont, predict_explain_models, export_explanation_to_excel, export_accuracy_to_excel
-from datasets.loadData import kfold
+from functions import base_parser, adjust_options, dataset_path, load_folds, select_criterion, cross_validation_process, delete_feature, join_cat_cont, predict_explain_models, export_explanation_to_excel, export_accuracy_to_excel, run_folds, load_steps, save_step, resume_step
+from datasets.loadData import kfold, TensorLoader
+from telemetry import Telemetry, NO_TELEMETRY
 
-parser = argparse.ArgumentParser()
+parser = argparse.ArgumentParser(parents=[base_parser()]) #opciones comunes con los scripts (functions.base_parser)
 
 # Parámetros obligatorios
 parser.add_argument('--typeExecution', required=True, type=str, choices=['loadData', 'train', 'explain'])
-parser.add_argument('--dset_id', required=True, type=int)
-parser.add_argument('--task', required=True, type=str,choices = ['binary','multiclass','regression'])
 
 # Parámetros de la ejecución
-parser.add_argument('--epochs', default=100, type=int)
-parser.add_argument('--batchsize', default=256, type=int)
-parser.add_argument('--optimizer', default='AdamW', type=str,choices = ['AdamW','Adam','SGD'])
-parser.add_argument('--scheduler', default='cosine', type=str,choices = ['cosine','linear'])
-parser.add_argument('--lr', default=0.0001, type=float)
+parser.add_argument('--validation_split', default=0.0, type=float) #fracción del train reservada para validación (0 = sin validación)
+parser.add_argument('--patience', default=None, type=int) #epochs sin mejorar la loss de validación antes de parar
+parser.add_argument('--warm_start', action='store_true') #en la eliminación recursiva cada modelo parte de los pesos del anterior
+parser.add_argument('--warm_start_epochs', default=20, type=int) #epochs de ajuste de los modelos con warm start
 parser.add_argument('--savemodelroot', default=os.path.relpath('./models/trained'), type=str)
-parser.add_argument('--savedatasetroot', default=os.path.relpath('./datasets/datasets_prepo'), type=str)
 parser.add_argument('--saveresultroot', default=os.path.relpath('./results/'), type=str)
+parser.add_argument('--resume', action='store_true') #reutiliza los pasos de <saveresultroot>/checkpoints hechos con la misma configuración y los mismos datos
 #parser.add_argument('--run_name', default='testrun', type=str)
-parser.add_argument('--set_seed', default= 1 , type=int)
-
-# Parámetros del Transformer
-parser.add_argument('--transformer_depth', default=6, type=int)
-parser.add_argument('--attention_heads', default=8, type=int)
-parser.add_argument('--attention_dropout', default=0.1, type=float)
-parser.add_argument('--attentiontype', default='colrow', type=str, choices = ['col','colrow','row','justmlp','attn','attnmlp']) #TODO: revisar
-parser.add_argument('--ff_dropout', default=0.1, type=float)
-
-# Parámetros del modelo SAINT
-parser.add_argument('--embedding_size', default=32, type=int)
-parser.add_argument('--cont_embeddings', default='MLP', type=str,choices = ['MLP','Noemb','pos_singleMLP'])
-parser.add_argument('--final_mlp_style', default='common', type=str,choices = ['common','sep'])
 
 # Otros parámetros
 parser.add_argument('--dset_seed', default= 5 , type=int)
+parser.add_argument('--fold_workers', default=1, type=int) #procesos en paralelo para las particiones (solo CPU)
+parser.add_argument('--ddp_workers', default=1, type=int) #procesos DistributedDataParallel (gloo) para entrenar cada modelo SAINT (solo CPU); se reparten los hilos de cada partición
+parser.add_argument('--bf16', action = 'store_true') #transformer con autocast a bfloat16 al entrenar, predecir y explicar
+parser.add_argument('--explain_batchsize', default=None, type=int) #filas por pasada de relprop al explicar (por defecto, los batches de entrenamiento)
+parser.add_argument('--lean_explanation', action = 'store_true') #relprop guardando solo lo que usa el rollout (menos memoria, mismas explicaciones)
+parser.add_argument('--explainer', default='lrp', type=str, choices = ['lrp','rollout']) #lrp: gradiente x LRP (ExplainationGenerator); rollout: solo forward (RolloutExplainer)
+parser.add_argument('--telemetry', action='store_true') #traza de tiempos/memoria de cada paso de SAINT en <saveresultroot>/telemetry
 
 opt = parser.parse_args()
 
@@ -57,8 +47,8 @@ torch.manual_seed(opt.set_seed)
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 print(f"\nDevice is {device}.\n")
 
-#dir_datasets_path = "." + os.sep + opt.savedatasetroot + os.sep + opt.task + os.sep + str(opt.dset_id) #cargar datos normales
-dir_datasets_path = "." + os.sep + opt.savedatasetroot + "_aleatorio" +  os.sep + opt.task + os.sep + str(opt.dset_id) #cargar datos + aleatorios
+#dir_datasets_path = dataset_path(opt.savedatasetroot, opt.task, opt.dset_id) #cargar datos normales
+dir_datasets_path = dataset_path(opt.savedatasetroot + "_aleatorio", opt.task, opt.dset_id) #cargar datos + aleatorios
 if opt.typeExecution == "loadData":
     if not os.path.exists(dir_datasets_path):
         os.makedirs(dir_datasets_path)
@@ -83,15 +73,7 @@ else:
     if not os.path.exists(dir_datasets_path):
         print("\nERROR - el dataset no está descargado, procesado y guardado")
     else:
-        folders = {}
-        for dir in os.scandir(dir_datasets_path):
-            folders[dir.name] = {}
-            if os.path.isdir(dir.path):
-                for file in os.scandir(dir.path):
-                    ds_file = open(file.path, "rb")
-                    ds = pickle.load(ds_file)
-                    folders[dir.name][file.name.split(".")[0]] = ds
-                    ds_file.close()
+        folders = load_folds(dir_datasets_path)
 
     print("\nDatasets descargados, ajustando parámetros...")
     if opt.task == 'regression': #TODO: revisar, dtask creo que no se usa, ydim si
@@ -103,19 +85,11 @@ else:
 
     cat_dims = [folders["train"]["fold0"].dataCat[i][2] for i in range(len(folders["train"]["fold0"].dataCat))] #list(zip(*(types_datasets["train"].dataCat)))[2] 
     cat_dims = np.append(np.array([1]),np.array(cat_dims)).astype(int) #Appending 1 for CLS token, this is later used to generate embeddings.
-    nfeat_orig = folders["train"]["fold0"].cat.shape[1] + folders["train"]["fold0"].cont.shape[1] 
+    nfeat_orig = folders["train"]["fold0"].num_features() 
     limit = nfeat_orig - int(nfeat_orig * 0.75) #AVANZAR NO HASTA LA MITAD SINO HASTA EL 75%
     features_names = [data[1] for _, data in enumerate(folders["train"]["fold0"].dataCat)] + [data[1] for _, data in enumerate(folders["train"]["fold0"].dataCont)]
     
-    if (nfeat_orig + 1) > 100:
-        opt.embedding_size = min(8,opt.embedding_size)
-        opt.batchsize = min(64, opt.batchsize)
-    if opt.attentiontype != 'col':
-        opt.transformer_depth = 1
-        opt.attention_heads = min(4,opt.attention_heads)
-        opt.attention_dropout = 0.8
-        opt.embedding_size = min(32,opt.embedding_size)
-        opt.ff_dropout = 0.8
+    adjust_options(opt, nfeat_orig)
 
 
 
@@ -129,6 +103,12 @@ else:
     
 
     print("COMENZANDO VALIDACIÓN CRUZADA...\n")
+    checkpoint_root = "." + os.sep + opt.saveresultroot + os.sep + "checkpoints" + os.sep + str(opt.dset_id) #resultados de cada paso, para poder reanudar
+    if not os.path.exists(checkpoint_root):
+        os.makedirs(checkpoint_root)
+    telemetry_root = "." + os.sep + opt.saveresultroot + os.sep + "telemetry" + os.sep + str(opt.dset_id)
+    if opt.telemetry and not os.path.exists(telemetry_root):
+        os.makedirs(telemetry_root)
     num_folders = len(folders["train"])
     criterion = select_criterion(y_dim, opt.task, device)
     dict_accuracy = {}
@@ -137,35 +117,48 @@ else:
     name_rows = ["nfeat"+str(nf) for nf in range(nfeat_orig, limit-1, -1)] # hasta el % 
     #name_rows = ["nfeat"+str(nf) for nf in range(nfeat_orig, 0, -1)] # solo nos quedamos con una variable
     print("----------------------------------------------Transformer: ")
-    dataloader_folders = copy.deepcopy(folders)    
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]  
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()  
         mms = MinMaxScaler()
+        model, feature_deleted = None, None
+        steps, checkpoint = load_steps(checkpoint_root, "Transformer", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            expls, metric_value = cross_validation_process(trainloader, testloader, y_dim, opt, device, criterion)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)       
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, model = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                telemetry = Telemetry(device, {"family": "Transformer", "fold": k, "nfeat": nfeat}) if opt.telemetry else NO_TELEMETRY
+                expls, metric_value, model = cross_validation_process(trainloader, testloader, y_dim, opt, device, criterion, model if opt.warm_start else None, feature_deleted, telemetry)
+                telemetry.save(telemetry_root + os.sep + "Transformer_fold" + str(k) + "_nfeat" + str(nfeat))
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)       
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmin(mean_feature_relevance)            
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, model if opt.warm_start else None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmin(mean_feature_relevance)            
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["Transformer"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -178,35 +171,48 @@ else:
 
 
     print("----------------------------------------------Transformer INVERSE: ")
-    dataloader_folders = copy.deepcopy(folders)    
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]  
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()  
         mms = MinMaxScaler()
+        model, feature_deleted = None, None
+        steps, checkpoint = load_steps(checkpoint_root, "TransformerINVERSE", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            expls, metric_value = cross_validation_process(trainloader, testloader, y_dim, opt, device, criterion)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)       
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, model = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                telemetry = Telemetry(device, {"family": "TransformerINVERSE", "fold": k, "nfeat": nfeat}) if opt.telemetry else NO_TELEMETRY
+                expls, metric_value, model = cross_validation_process(trainloader, testloader, y_dim, opt, device, criterion, model if opt.warm_start else None, feature_deleted, telemetry)
+                telemetry.save(telemetry_root + os.sep + "TransformerINVERSE_fold" + str(k) + "_nfeat" + str(nfeat))
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)       
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmax(mean_feature_relevance)            
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, model if opt.warm_start else None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmax(mean_feature_relevance)            
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["TransformerINVERSE"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -228,37 +234,47 @@ else:
     from sklearn.svm import SVC
     svc = SVC(kernel="linear", probability=True)
     print("\n\n---------------------------------------------SVM: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "SVM", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            svc.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(svc, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                svc.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(svc, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmin(mean_feature_relevance)                  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmin(mean_feature_relevance)                  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
             
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["SVM"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -271,37 +287,47 @@ else:
 
 
     print("\n\n---------------------------------------------SVM INVERSE: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "SVM_INVERSE", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            svc.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(svc, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                svc.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(svc, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmax(mean_feature_relevance)                  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmax(mean_feature_relevance)                  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
             
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["SVM_INVERSE"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -319,37 +345,47 @@ else:
     from sklearn.neighbors import KNeighborsClassifier
     knn = KNeighborsClassifier(n_neighbors=3)
     print("\n\n---------------------------------------------KNN: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "KNN", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            knn.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(knn, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                knn.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(knn, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmin(mean_feature_relevance)  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmin(mean_feature_relevance)  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["KNN"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -362,37 +398,47 @@ else:
 
 
     print("\n\n---------------------------------------------KNN INVERSE: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "KNN_INVERSE", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            knn.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(knn, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                knn.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(knn, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmax(mean_feature_relevance)  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmax(mean_feature_relevance)  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["KNN_INVERSE"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -413,37 +459,47 @@ else:
     from sklearn.neural_network import MLPClassifier
     mlp = MLPClassifier()
     print("\n\n---------------------------------------------MLP: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "MLP", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            mlp.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                mlp.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmin(mean_feature_relevance)  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmin(mean_feature_relevance)  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["MLP"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -458,37 +514,47 @@ else:
 
 
     print("\n\n---------------------------------------------MLP INVERSE: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "MLP_INVERSE", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            mlp.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                mlp.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmax(mean_feature_relevance)  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmax(mean_feature_relevance)  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["MLP_INVERSE"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -505,37 +571,47 @@ else:
     from sklearn.ensemble import RandomForestClassifier
     rf = RandomForestClassifier()
     print("\n\n---------------------------------------------Random Forest: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):        
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "RandomForest", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            mlp.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                mlp.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmin(mean_feature_relevance)  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmin(mean_feature_relevance)  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["RandomForest"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -549,37 +625,47 @@ else:
 
 
     print("\n\n---------------------------------------------Random Forest INVERSE: ")
-    dataloader_folders = copy.deepcopy(folders)
+    dataloader_folders = {split: {name: ds.view() for name, ds in folders[split].items()} for split in folders} #vistas, sin copiar los datos
     accuracy = np.zeros(shape=(num_folders, nfeat_orig-limit+1)) # hasta el % 
     #accuracy = np.zeros(shape=(num_folders, nfeat_orig)) # solo nos quedamos con una variable
     explanation = np.zeros(shape=(num_folders, nfeat_orig-limit+1), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # hasta el %
     #explanation = np.zeros(shape=(num_folders, nfeat_orig), dtype=list(zip(features_names, [np.float64 for i in range(0, len(features_names))]))) # solo nos quedamos con una variable
-    for k in range(0, num_folders):        
+    def fold(k):
         print("Partición " + str(k))
-        trainloader = DataLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True,num_workers=4) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
-        testloader = DataLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False,num_workers=4) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
-        nfeat = trainloader.dataset.cat.shape[1] + trainloader.dataset.cont.shape[1]
+        trainloader = TensorLoader(dataloader_folders["train"]["fold"+str(k)], batch_size=opt.batchsize, shuffle=True) #print("\tNº datos en train: " + str(len(trainloader.dataset)))
+        testloader = TensorLoader(dataloader_folders["test"]["fold"+str(k)], batch_size=len(dataloader_folders["test"]["fold"+str(k)]), shuffle=False) #print("\tNº datos en test: " + str(len(testloader.dataset)))print("\tNº datos en test: " + str(len(testloader.dataset)))
+        nfeat = trainloader.dataset.num_features()
         mms = MinMaxScaler()
+        steps, checkpoint = load_steps(checkpoint_root, "RandomForestINVERSE", k, opt, (trainloader.dataset, testloader.dataset))
 
         while nfeat >= limit: # hasta el %
         #while nfeat >= 1: # solo nos quedamos con una variable
-            X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
-            mlp.fit(X_train, y_train.ravel())
-            expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
-            accuracy[k][nfeat_orig-nfeat] = metric_value.item()
-            attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
-            mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
-            expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+            step = nfeat_orig - nfeat
+            if step < len(steps): #paso ya calculado en una ejecución anterior
+                metric_value, expl_for_save, feature_deleted, _ = resume_step(steps[step], trainloader.dataset, y_dim, opt)
+            else:
+                X_train, y_train, X_test, y_test = join_cat_cont(trainloader, testloader)
+                mlp.fit(X_train, y_train.ravel())
+                expls, metric_value = predict_explain_models(mlp, X_train, X_test, y_test, device, False)
+                attribute_names_ordered = [data[1] for _, data in enumerate(trainloader.dataset.dataCat)] + [data[1] for _, data in enumerate(trainloader.dataset.dataCont)]
+                mean_feature_relevance = mms.fit_transform(expls.mean(dim=0).cpu().detach().numpy().reshape(-1, 1)).reshape(1, -1)
+                expl_for_save = dict(zip(attribute_names_ordered, mean_feature_relevance[0]))
+                feature_deleted = np.argmax(mean_feature_relevance)  
+                print("\t\tNombre variables: " + str(attribute_names_ordered))
+                print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
+                print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                save_step(checkpoint, steps, metric_value, expl_for_save, feature_deleted, None)
+            accuracy[k][step] = metric_value.item()
             for key in expl_for_save:
-                explanation[k][nfeat_orig-nfeat][key] = np.float64(expl_for_save[key])
-            feature_deleted = np.argmax(mean_feature_relevance)  
-            print("\t\tNombre variables: " + str(attribute_names_ordered))
-            print("\t\tRelevancia de las variables: " + str(mean_feature_relevance))
-            print("\t\tEliminamos una variable... con id: " + str(feature_deleted))
+                explanation[k][step][key] = np.float64(expl_for_save[key])
             trainloader, testloader, nfeat = delete_feature(trainloader, testloader, feature_deleted)
 
         torch.cuda.empty_cache()
         gc.collect()
+        return accuracy[k], explanation[k]
+
+    for k, (accuracy_k, explanation_k) in enumerate(run_folds(fold, num_folders, opt.fold_workers, opt.set_seed, device)):
+        accuracy[k], explanation[k] = accuracy_k, explanation_k
 
     dict_accuracy["RandomForestINVERSE"] = pd.DataFrame(accuracy.transpose(), columns=name_columns, index=name_rows) 
     dfs_explanation = []
@@ -597,9 +683,9 @@ else:
     result_path = "." + os.sep + opt.saveresultroot
     if not os.path.exists(result_path):
         os.makedirs(result_path)
-    export_accuracy_to_excel(result_path, trainloader.dataset.name, dict_accuracy, nfeat_orig-limit+1, name_columns, name_rows) # hasta el %
-    #export_accuracy_to_excel(result_path, trainloader.dataset.name, dict_accuracy, nfeat_orig, name_columns, name_rows) # solo nos quedamos con una variable
-    export_explanation_to_excel(result_path, trainloader.dataset.name, dict_explanation)
+    export_accuracy_to_excel(result_path, folders["train"]["fold0"].name, dict_accuracy, nfeat_orig-limit+1, name_columns, name_rows) # hasta el %
+    #export_accuracy_to_excel(result_path, folders["train"]["fold0"].name, dict_accuracy, nfeat_orig, name_columns, name_rows) # solo nos quedamos con una variable
+    export_explanation_to_excel(result_path, folders["train"]["fold0"].name, dict_explanation)
 
     print("END")
 
@@ -0,0 +1,35 @@
+import torch
+import functions
+from .ExplainationGenerator import compute_rollout_attention
+
+class RolloutExplainer:
+    #explicación barata con un solo forward (sin backward ni relprop): rollout de los mapas de atención a columnas
+    #de todas las capas, con la media de las cabezas o una media ponderada (head_weights, uno por cabeza).
+    #Misma interfaz y salida que ExplainationGenerator.generateExplanation_all (relevancia por token, CLS incluido)
+    def __init__(self, model, head_weights=None, start_layer=0):
+        self.model = model
+        self.head_weights = head_weights
+        self.start_layer = start_layer
+        self.model.eval()
+
+    def generateExplanation_all(self, nuevo_categ_enc, nuevo_cont_enc, device, bf16=False):
+        with torch.no_grad(), self.model.attention_capture():
+            with functions.autocast(nuevo_categ_enc.device, bf16):
+                reps = self.model.transformer(nuevo_categ_enc, nuevo_cont_enc)
+            output = self.model.mlpfory(reps[:,0,:].float())
+
+            maps = []
+            for blk in self.model.transformer.layers:
+                for _ in blk:
+                    component = _.fn.fn
+                    if component.__class__.__name__ == "Attention" and component.attn is not None:
+                        attn = component.attn.float()
+                        if self.head_weights is None:
+                            maps.append(attn.mean(dim=1))
+                        else:
+                            weights = torch.as_tensor(self.head_weights, dtype=attn.dtype, device=attn.device)
+                            maps.append(torch.einsum('bhij,h->bij', attn, weights / weights.sum()))
+
+        rollouts = compute_rollout_attention(maps, start_layer=self.start_layer)[:, 0]
+        rollouts[:, 0] = rollouts.min(dim=1).values #como en ExplainationGenerator, el CLS no cuenta
+        return rollouts, output
@@ -2,8 +2,11 @@ import torch
 from torch import nn
 import numpy as np
 import torch.nn.functional as F
+import math
+from contextlib import contextmanager
 from .SAINT_Transformer import SAINT_Transformer
 from utils import Linear
+import functions
 
 class MLP(nn.Module):
     def __init__(self, dims, act = None):
@@ -49,6 +52,42 @@ class simple_MLP(nn.Module):
         return R
 
 
+class batched_MLP(nn.Module):
+    #equivale a una lista de num simple_MLP([1, hidden, dim]) (una por variable continua) pero con los pesos
+    #apilados, de forma que todas las columnas se embeben con un único einsum en lugar de un bucle por columna
+    def __init__(self, num, dims):
+        super(batched_MLP, self).__init__()
+        self.num = num
+        self.dims = dims
+        self.weight1 = nn.Parameter(torch.empty(num, dims[1], dims[0]))
+        self.bias1 = nn.Parameter(torch.empty(num, dims[1]))
+        self.weight2 = nn.Parameter(torch.empty(num, dims[2], dims[1]))
+        self.bias2 = nn.Parameter(torch.empty(num, dims[2]))
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        #misma inicialización que nn.Linear: U(-1/sqrt(fan_in), 1/sqrt(fan_in))
+        for weight, bias in ((self.weight1, self.bias1), (self.weight2, self.bias2)):
+            bound = 1 / math.sqrt(weight.shape[-1])
+            nn.init.uniform_(weight, -bound, bound)
+            nn.init.uniform_(bias, -bound, bound)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        #checkpoints antiguos: nn.ModuleList de simple_MLP -> {prefix}{i}.layers.{0,2}.{weight,bias}
+        if prefix + "weight1" not in state_dict and prefix + "0.layers.0.weight" in state_dict:
+            for name, layer in (("1", 0), ("2", 2)):
+                for param in ("weight", "bias"):
+                    keys = [prefix + str(i) + ".layers." + str(layer) + "." + param for i in range(self.num)]
+                    state_dict[prefix + param + name] = torch.stack([state_dict.pop(key) for key in keys])
+        super(batched_MLP, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def forward(self, x):
+        #x: (b, num) -> (b, num, dim); internamente se trabaja como (num, b, ...) para usar baddbmm por grupo
+        X = x.t().unsqueeze(-1)
+        H = F.relu(torch.baddbmm(self.bias1.unsqueeze(1), X, self.weight1.transpose(1, 2)))
+        return torch.baddbmm(self.bias2.unsqueeze(1), H, self.weight2.transpose(1, 2)).transpose(0, 1)
+
+
 #TODO: falta meterle a este el relprop, para que si se usa al final del modelo
 class sep_MLP(nn.Module):
     def __init__(self,dim,len_feats,categories):
@@ -91,7 +130,10 @@ class SAINT(nn.Module):
         scalingfactor = 10,
         attentiontype = 'col',
         final_mlp_style = 'common',
-        y_dim = 2
+        y_dim = 2,
+        row_memory_budget = None,
+        row_topk = None,
+        pretraining_heads = True
         ):
         super().__init__()
         assert all(map(lambda n: n > 0, categories)), 'number of each category must be positive'
@@ -125,10 +167,11 @@ class SAINT(nn.Module):
         self.final_mlp_style = final_mlp_style
 
         if self.cont_embeddings == 'MLP':
-            self.simple_MLP = nn.ModuleList([simple_MLP([1,100,self.dim]) for _ in range(self.num_continuous)])
+            self.simple_MLP = batched_MLP(self.num_continuous, [1,100,self.dim])
             input_size = (dim * self.num_categories)  + (dim * num_continuous)
             nfeats = self.num_categories + num_continuous
         elif self.cont_embeddings == 'pos_singleMLP':
+            #MLP compartida por todas las variables continuas + pos_encodings (ver functions.embed_data_mask)
             self.simple_MLP = nn.ModuleList([simple_MLP([1,100,self.dim]) for _ in range(1)])
             input_size = (dim * self.num_categories)  + (dim * num_continuous)
             nfeats = self.num_categories + num_continuous
@@ -148,16 +191,19 @@ class SAINT(nn.Module):
                 dim_head = dim_head,
                 attn_dropout = attn_dropout,
                 ff_dropout = ff_dropout,
-                style = attentiontype
+                style = attentiontype,
+                row_memory_budget = row_memory_budget,
+                row_topk = row_topk
             )
         else:
             print("errorrrrrrrrrrrrrrrr") #TODO
 
-        l = input_size // 8
-        hidden_dimensions = list(map(lambda t: l * t, mlp_hidden_mults))
-        all_dimensions = [input_size, *hidden_dimensions, dim_out]
-        
-        self.mlp = MLP(all_dimensions, act = mlp_act)
+        self.categories = categories
+        self.input_size = input_size
+        self.mlp_hidden_mults = mlp_hidden_mults
+        self.mlp_act = mlp_act
+        self.dim_out = dim_out
+
         self.embeds = nn.Embedding(self.total_tokens, self.dim) #.to(device)
 
         cat_mask_offset = F.pad(torch.Tensor(self.num_categories).fill_(2).type(torch.int8), (1, 0), value = 0) 
@@ -173,24 +219,90 @@ class SAINT(nn.Module):
         self.mask_embeds_cont = nn.Embedding(self.num_continuous*2, self.dim)
         self.single_mask = nn.Embedding(2, self.dim)
         self.pos_encodings = nn.Embedding(self.num_categories+ self.num_continuous, self.dim)
-        
+
+        self.mlpfory = simple_MLP([dim ,1000, y_dim])
+
+        #las cabezas de preentrenamiento/reconstrucción no se usan en el entrenamiento supervisado; con
+        #pretraining_heads=False no se crean (y forward, que las necesita, da error)
+        self.pretraining_heads = pretraining_heads
+        if pretraining_heads:
+            self.build_pretraining_heads()
+
+    def build_pretraining_heads(self):
+        #solo desde __init__: los parámetros tienen que existir antes de crear el optimizador
+        dim = self.dim
+
+        l = self.input_size // 8
+        hidden_dimensions = list(map(lambda t: l * t, self.mlp_hidden_mults))
+        all_dimensions = [self.input_size, *hidden_dimensions, self.dim_out]
+
+        self.mlp = MLP(all_dimensions, act = self.mlp_act)
+
         if self.final_mlp_style == 'common':
             self.mlp1 = simple_MLP([dim,(self.total_tokens)*2, self.total_tokens])
             self.mlp2 = simple_MLP([dim ,(self.num_continuous), 1])
 
         else:
-            self.mlp1 = sep_MLP(dim,self.num_categories,categories)
+            self.mlp1 = sep_MLP(dim,self.num_categories,self.categories)
             self.mlp2 = sep_MLP(dim,self.num_continuous,np.ones(self.num_continuous).astype(int))
 
-
-        self.mlpfory = simple_MLP([dim ,1000, y_dim])
         self.pt_mlp = simple_MLP([dim*(self.num_continuous+self.num_categories) ,6*dim*(self.num_continuous+self.num_categories)//5, dim*(self.num_continuous+self.num_categories)//2])
         self.pt_mlp2 = simple_MLP([dim*(self.num_continuous+self.num_categories) ,6*dim*(self.num_continuous+self.num_categories)//5, dim*(self.num_continuous+self.num_categories)//2])
 
+    @contextmanager
+    def relprop_mode(self, lean=False):
+        #los hooks de relprop (entradas guardadas, mapas de atención y sus gradientes) solo se activan dentro de
+        #una explicación; al salir se liberan para que entrenar y predecir no guarden copias de las activaciones.
+        #lean: solo se guarda lo que usa el rollout (grad x cam ya reducido de la atención a columnas, ver
+        #Attention.relprop) y cada capa libera su entrada al hacer su relprop
+        modules = [m for m in self.modules() if hasattr(m, 'relprop_enabled')]
+        for m in modules:
+            m.relprop_enabled = True
+            m.relprop_lean = lean
+        try:
+            yield self
+        finally:
+            for m in modules:
+                m.relprop_enabled = False
+                m.relprop_lean = False
+                for name in ('X', 'Y'):
+                    m.__dict__.pop(name, None)
+                if hasattr(m, 'attn'):
+                    m.attn = m.attn_cam = m.attn_gradients = m.attn_relevance = None
+
+    @contextmanager
+    def attention_capture(self):
+        #las atenciones a columnas guardan su mapa (b, heads, n, n) en attn durante el forward normal (sin relprop
+        #ni hooks); lo usa models.RolloutExplainer
+        modules = [m for m in self.modules() if hasattr(m, 'keep_attn')]
+        for m in modules:
+            m.keep_attn = True
+        try:
+            yield self
+        finally:
+            for m in modules:
+                m.keep_attn = False
+                m.attn = None
+
+    @contextmanager
+    def shared_rows(self, group):
+        #entrenamiento distribuido (functions.train_distributed): cada proceso tiene una parte de las filas del
+        #batch y la atención entre filas junta las keys/values de los procesos de group (ver gather_rows)
+        modules = [m for m in self.modules() if hasattr(m, 'row_group')]
+        for m in modules:
+            m.row_group = group
+        try:
+            yield self
+        finally:
+            for m in modules:
+                m.row_group = None
+
     """def set_num_features(self, num_features):
         self.num_features = num_features"""
         
     def forward(self, x_categ, x_cont):
+        if not self.pretraining_heads:
+            raise Exception("ERROR - SAINT.forward necesita las cabezas de preentrenamiento: crea el modelo con pretraining_heads = True")
         x = self.transformer(x_categ, x_cont)
         cat_outs = self.mlp1(x[:,:self.num_categories,:])
         con_outs = self.mlp2(x[:,self.num_categories:,:])
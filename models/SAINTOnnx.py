@@ -0,0 +1,25 @@
+import inspect
+import torch
+import warnings
+from models.SAINTPredictor import SAINTInference
+
+input_names = ['x_categ', 'x_cont', 'cat_mask', 'con_mask']
+output_names = ['logits']
+
+def export_onnx(model, path, x_categ, x_cont, cat_mask, con_mask, opset_version=17):
+    #exporta a ONNX el grafo completo de inferencia (offsets categóricos, embeddings de máscara, MLPs continuas,
+    #transformer y mlpfory): entradas en bruto -> logits, con el tamaño de batch dinámico.
+    #El grafo resultante se puede evaluar con onnxruntime sin importar torch.
+    inference = SAINTInference(model).eval()
+    dynamic_axes = {name: {0: 'batch'} for name in input_names + output_names}
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        #el exportador dynamo no genera un Split válido para opset 17; se usa el exportador por trazado
+        kwargs['dynamo'] = False
+    with torch.no_grad(), warnings.catch_warnings():
+        #los recortes del CLS dependen solo de las columnas, no del batch, así que la traza es válida
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        torch.onnx.export(inference, (x_categ, x_cont.float(), cat_mask, con_mask), path,
+                          input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset_version, **kwargs)
+    return path
@@ -0,0 +1,76 @@
+import torch
+import warnings
+from torch import nn
+import functions
+
+class SAINTInference(nn.Module):
+    #grafo completo de inferencia: embed_data_mask + transformer (solo CLS en la última capa) + mlpfory
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x_categ, x_cont, cat_mask, con_mask, row_mask=None):
+        _ , x_categ_enc, x_cont_enc = functions.embed_data_mask(x_categ, x_cont, cat_mask, con_mask, self.model)
+        reps = self.model.transformer(x_categ_enc, x_cont_enc, mask=row_mask, cls_only=True)
+        return self.model.mlpfory(reps[:,0,:])
+
+
+class SAINTPredictor:
+    #predictor compilado de un SAINT ya entrenado (solo CPU/inferencia, sin explicación).
+    #Los batches se rellenan hasta el tamaño de bucket inmediatamente superior para reutilizar un grafo por bucket;
+    #las filas de relleno se excluyen de la atención entre filas (row_mask), así que no cambian las predicciones.
+    #backend: 'compile' (torch.compile), 'trace' (torch.jit.trace, un grafo por bucket) o 'eager'
+    def __init__(self, model, backend='compile', buckets=(1, 16, 64, 256, 1024)):
+        self.model = model.eval()
+        self.inference = SAINTInference(model).eval()
+        self.backend = backend
+        self.buckets = sorted(buckets)
+        self.graphs = {}
+        if backend == 'compile':
+            self.compiled = torch.compile(self.inference, dynamic=False)
+
+    def bucket(self, n):
+        for size in self.buckets:
+            if n <= size:
+                return size
+        #por encima del mayor bucket se redondea a un múltiplo suyo
+        return -(-n // self.buckets[-1]) * self.buckets[-1]
+
+    def graph(self, size, inputs):
+        if self.backend == 'eager':
+            return self.inference
+        if self.backend == 'compile':
+            return self.compiled
+        if size not in self.graphs:
+            if self.backend == 'trace':
+                with warnings.catch_warnings():
+                    #las formas quedan fijas por bucket, que es justo lo que se quiere
+                    warnings.simplefilter('ignore', torch.jit.TracerWarning)
+                    self.graphs[size] = torch.jit.freeze(torch.jit.trace(self.inference, inputs, check_trace=False))
+            else:
+                raise Exception('Backend ' + str(self.backend) + ' no soportado')
+        return self.graphs[size]
+
+    def pad(self, x, size, value):
+        if x.shape[0] == size:
+            return x
+        padding = torch.full((size - x.shape[0],) + tuple(x.shape[1:]), value, dtype=x.dtype, device=x.device)
+        return torch.cat((x, padding), dim=0)
+
+    def __call__(self, x_categ, x_cont, cat_mask, con_mask):
+        n = x_categ.shape[0]
+        size = self.bucket(n)
+        row_mask = torch.arange(size, device=x_categ.device) < n
+        inputs = (self.pad(x_categ, size, 0), self.pad(x_cont, size, 0), self.pad(cat_mask, size, 1), self.pad(con_mask, size, 1), row_mask)
+        with torch.no_grad():
+            return self.graph(size, inputs)(*inputs)[:n]
+
+    def predict(self, dataset, device):
+        #igual que functions.predict pero con el grafo compilado
+        y_preds, y_gts_all = [], []
+        for i, data in enumerate(dataset, 0):
+            x_categ, x_cont, y_gts, cat_mask, con_mask = data[0].to(device), data[1].to(device),data[2].to(device),data[3].to(device),data[4].to(device)
+            y_outs = self(x_categ, x_cont, cat_mask, con_mask)
+            y_preds.append(torch.argmax(y_outs, dim=1, keepdim=True))
+            y_gts_all.append(y_gts)
+        return torch.cat(y_preds), torch.cat(y_gts_all)
@@ -0,0 +1,21 @@
+import copy
+import torch
+from torch import nn
+from utils import Linear
+
+def quantize_saint(model, dtype=torch.qint8):
+    #copia de inferencia de un SAINT entrenado con las capas lineales cuantizadas dinámicamente (int8, solo CPU).
+    #quantize_dynamic solo acepta nn.Linear exacto, así que antes se cambia cada utils.Linear por un nn.Linear
+    #con los mismos pesos. Límites de la copia:
+    #  - solo se cuantizan las capas lineales; el embedding de las variables continuas (batched_MLP, pesos apilados
+    #    que se aplican con einsum/baddbmm), los embeddings y las LayerNorm siguen en float32
+    #  - pierde los hooks y el estado de relprop: sirve para predecir, no para explicar (ExplainationGenerator y
+    #    RolloutExplainer necesitan el modelo float)
+    qmodel = copy.deepcopy(model).cpu().eval()
+    for module in list(qmodel.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, Linear):
+                linear = nn.Linear(child.in_features, child.out_features, bias = child.bias is not None)
+                linear.load_state_dict(child.state_dict())
+                setattr(module, name, linear)
+    return torch.ao.quantization.quantize_dynamic(qmodel, {nn.Linear}, dtype=dtype)
@@ -2,6 +2,7 @@ import torch
 from torch import nn, einsum
 from einops import rearrange
 import torch.nn.functional as F
+import torch.distributed as dist
 from utils import Linear, MatMul, Softmax, Clone
 import math
 
@@ -29,22 +30,68 @@ class Residual(nn.Module):
         self.fn = fn
 
     def forward(self, x, **kwargs):
-        return self.fn(x, **kwargs) + x
+        out = self.fn(x, **kwargs)
+        if out.shape != x.shape: #solo se ha calculado la parte del CLS (cls_only / out_features)
+            x = x[..., :out.shape[-2], :out.shape[-1]]
+        return out + x
     
     def relprop(self, cam, **kwargs):
         #TODO: revisar, se supone que lo residual se ignora para propagar la relevancia
         cam = self.fn.relprop(cam, **kwargs)
         return cam
     
+class GatherRows(torch.autograd.Function):
+    #all_gather por el eje de filas (dim 2) de los bloques de todos los procesos de group, todos del mismo tamaño.
+    #En backward cada proceso se queda con la suma de los gradientes de su bloque en todos los procesos (con
+    #all_reduce, porque gloo no tiene reduce_scatter)
+    @staticmethod
+    def forward(ctx, tensor, group):
+        ctx.group = group
+        ctx.rank = dist.get_rank(group)
+        ctx.rows = tensor.shape[2]
+        parts = [torch.empty_like(tensor) for _ in range(dist.get_world_size(group))]
+        dist.all_gather(parts, tensor.contiguous(), group=group)
+        return torch.cat(parts, dim=2)
+
+    @staticmethod
+    def backward(ctx, grad):
+        grad = grad.contiguous()
+        dist.all_reduce(grad, group=ctx.group)
+        return grad[:, :, ctx.rank * ctx.rows:(ctx.rank + 1) * ctx.rows], None
+
+
+def gather_rows(key_layer, value_layer, group):
+    #entrenamiento distribuido: cada proceso tiene una parte de las filas del batch y las keys/values de todas las
+    #partes se juntan para que sus filas atiendan al batch completo, como en un solo proceso. Las partes pueden
+    #diferir en una fila: se rellenan hasta la mayor y el relleno se excluye con la máscara que se devuelve
+    rows = torch.tensor([key_layer.shape[2]])
+    sizes = [torch.zeros_like(rows) for _ in range(dist.get_world_size(group))]
+    dist.all_gather(sizes, rows, group=group)
+    sizes = [int(size) for size in sizes]
+    most = max(sizes)
+    kv = F.pad(torch.cat((key_layer, value_layer), dim=-1), (0, 0, 0, most - key_layer.shape[2]))
+    key_layer, value_layer = GatherRows.apply(kv, group).chunk(2, dim=-1)
+    mask = None
+    if min(sizes) < most:
+        mask = torch.cat([torch.arange(most) < size for size in sizes]).to(key_layer.device)
+    return key_layer, value_layer, mask
+
+
 class Attention(nn.Module):
     def __init__(
         self,
         dim,
         heads = 8,
         dim_head = 16,
-        dropout = 0.
+        dropout = 0.,
+        memory_budget = None,
+        topk = None,
+        rows = False
     ):
         super().__init__()
+        self.rows = rows #atención entre filas: su mapa no se usa en la explicación
+        self.memory_budget = memory_budget #MB para la matriz de scores de un bloque de queries (None = sin límite)
+        self.topk = topk #si se indica, cada query solo atiende a sus topk keys con mayor score
         self.dim_head = dim_head
         self.inner_dim = dim_head * heads
         self.heads = heads
@@ -65,9 +112,15 @@ class Attention(nn.Module):
         self.clone = Clone()
 
         #Añadido nuevo
+        self.relprop_enabled = False
+        self.relprop_lean = False
         self.attn_cam = None
         self.attn = None
         self.attn_gradients = None
+        self.attn_relevance = None #modo lean: (grad x cam).clamp(min=0) medio sobre las cabezas
+        self.keep_attn = False #SAINT.attention_capture(): el camino rápido guarda los mapas de atención a columnas
+        self.fused_cache = {} #pesos QKV concatenados para el camino rápido sin gradientes (ver fused)
+        self.row_group = None #SAINT.shared_rows(): al entrenar, las filas del batch están repartidas entre procesos
     
     def get_attn(self):
         return self.attn
@@ -97,7 +150,87 @@ class Attention(nn.Module):
     def transpose_for_scores_relprop(self, x):
         return x.permute(0, 2, 1, 3).flatten(2)
 
-    def forward(self, x):
+    def attend(self, q, k, v, mask=None):
+        #q, k, v: (b, h, n, d). Con memory_budget las queries se procesan por bloques para que la matriz de scores
+        #de cada bloque (b x h x bloque x n) no supere el presupuesto; el resultado es el mismo que sin bloques.
+        #mask: (n_keys,) booleano, False = key que no se atiende (filas de relleno)
+        if mask is not None:
+            mask = mask.view(1, 1, 1, -1)
+        if not self.rows and mask is None:
+            #atención a columnas: muchas secuencias cortas (n = número de variables), para las que matmul + softmax
+            #es más rápido que el kernel fusionado de scaled_dot_product_attention
+            return torch.matmul(torch.matmul(q, k.transpose(-1, -2)).mul(self.scale).softmax(dim=-1), v)
+        if self.memory_budget is None and self.topk is None:
+            return F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+        b, h, n_queries, _ = q.shape
+        n_keys = k.shape[-2]
+        if self.memory_budget is None:
+            chunk = n_queries
+        else:
+            chunk = max(1, int(self.memory_budget * 2**20) // (b * h * n_keys * q.element_size()))
+        outputs = []
+        for start in range(0, n_queries, chunk):
+            q_chunk = q[:, :, start:start + chunk]
+            if self.topk is None or self.topk >= n_keys:
+                outputs.append(F.scaled_dot_product_attention(q_chunk, k, v, attn_mask=mask))
+            else:
+                scores = torch.matmul(q_chunk, k.transpose(-1, -2)) * self.scale
+                if mask is not None:
+                    scores = scores.masked_fill(~mask, float('-inf'))
+                scores, index = scores.topk(self.topk, dim=-1)
+                index = index.unsqueeze(-1).expand(-1, -1, -1, -1, v.shape[-1])
+                neighbours = torch.gather(v.unsqueeze(2).expand(-1, -1, q_chunk.shape[2], -1, -1), 3, index)
+                outputs.append(torch.einsum('bhqk,bhqkd->bhqd', scores.softmax(dim=-1), neighbours))
+        return torch.cat(outputs, dim=2)
+
+    def forward_fast(self, x, cls_only=False, mask=None):
+        #camino solo para inferencia (sin relprop): proyección QKV fusionada con los pesos de query/key/value
+        #y scaled_dot_product_attention, sin guardar atenciones ni registrar hooks
+        if cls_only:
+            #solo la query del token CLS (primer token), las keys y values de todos
+            query_layer = self.transpose_for_scores(self.projection(x[:, :1], (self.query,)))
+            key_layer, value_layer = map(self.transpose_for_scores, self.projection(x, (self.key, self.value)).chunk(2, dim=-1))
+        else:
+            query_layer, key_layer, value_layer = map(self.transpose_for_scores, self.projection(x, (self.query, self.key, self.value)).chunk(3, dim=-1))
+        if self.rows and self.row_group is not None and self.training:
+            #las queries son las filas de este proceso; las keys y values, las de todo el batch (mask solo se usa
+            #al predecir, no al entrenar)
+            key_layer, value_layer, mask = gather_rows(key_layer, value_layer, self.row_group)
+        if self.keep_attn and not self.rows:
+            #atención explícita (n x n por ejemplo, pequeña en la atención a columnas) para poder guardar el mapa
+            self.attn = torch.matmul(query_layer, key_layer.transpose(-1, -2)).mul(self.scale).softmax(dim=-1)
+            context_layer = torch.matmul(self.attn.type_as(value_layer), value_layer)
+        else:
+            context_layer = self.attend(query_layer, key_layer, value_layer, mask)
+        context_layer = context_layer.permute(0, 2, 1, 3).reshape(query_layer.shape[0], query_layer.shape[2], self.inner_dim)
+        return self.to_out(context_layer)
+
+    def projection(self, x, layers):
+        #proyección fusionada (una sola matmul) de varias capas lineales sobre la misma entrada; si las capas
+        #están cuantizadas (no tienen weight de tipo tensor) se aplica cada una y se concatenan
+        if all(isinstance(layer, nn.Linear) for layer in layers):
+            weight, bias = self.fused(layers)
+            return F.linear(x, weight, bias)
+        return torch.cat([layer(x) for layer in layers], dim=-1)
+
+    def fused(self, layers):
+        #pesos concatenados de layers. Sin gradientes (predicción/explicación rápida) se guardan y solo se rehacen si
+        #algún peso cambia (optimizador, load_state_dict, .to); entrenando se concatenan en cada llamada para que el
+        #gradiente llegue a query/key/value
+        if torch.is_grad_enabled() or torch.compiler.is_compiling():
+            return torch.cat([layer.weight for layer in layers]), torch.cat([layer.bias for layer in layers])
+        key = tuple((t.data_ptr(), t._version) for layer in layers for t in (layer.weight, layer.bias))
+        names = tuple(id(layer) for layer in layers)
+        cached = self.fused_cache.get(names)
+        if cached is None or cached[0] != key:
+            cached = self.fused_cache[names] = (key, torch.cat([layer.weight for layer in layers]), torch.cat([layer.bias for layer in layers]))
+        return cached[1], cached[2]
+
+    def forward(self, x, cls_only=False, mask=None):
+        #fuera de SAINT.relprop_mode() no hay explicación, se usa el camino rápido (también para entrenar)
+        if not self.relprop_enabled:
+            return self.forward_fast(x, cls_only, mask)
+
         """h = self.heads
         q, k, v = self.to_qkv(x).chunk(3, dim = -1)
         q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> b h n d', h = h), (q, k, v))
@@ -120,11 +253,18 @@ class Attention(nn.Module):
 
         attention_scores = self.matmul1([query_layer, key_layer.transpose(-1, -2)])
         attention_scores = attention_scores / math.sqrt(self.dim_head)
+        if mask is not None:
+            attention_scores = attention_scores.masked_fill(~mask.view(1, 1, 1, -1), float('-inf'))
+        if self.topk is not None and self.topk < attention_scores.shape[-1]:
+            #mismo top-k que attend(): las keys fuera del top-k de cada query quedan con probabilidad 0
+            keep = torch.zeros_like(attention_scores, dtype=torch.bool).scatter_(-1, attention_scores.topk(self.topk, dim=-1)[1], True)
+            attention_scores = attention_scores.masked_fill(~keep, float('-inf'))
 
         attention_probs = self.softmax(attention_scores)
 
-        self.save_attn(attention_probs)
-        if self.training != True and x.requires_grad != False:
+        if not self.relprop_lean:
+            self.save_attn(attention_probs)
+        if self.training != True and x.requires_grad != False and not (self.relprop_lean and self.rows):
             attention_probs.register_hook(self.save_attn_gradients)
         
         context_layer = self.matmul2([attention_probs, value_layer])
@@ -147,7 +287,13 @@ class Attention(nn.Module):
             # [attention_probs, head_mask]
             #(cam1, _)= self.mul.relprop(cam1, **kwargs)
 
-        self.save_attn_cam(cam1)
+        if not self.relprop_lean:
+            self.save_attn_cam(cam1)
+        else:
+            #lo único que consume el rollout, ya reducido; el gradiente completo se libera aquí
+            if not self.rows:
+                self.attn_relevance = (self.attn_gradients * cam1).clamp(min=0).mean(dim=1)
+            self.attn_gradients = None
 
         #cam1 = self.dropout.relprop(cam1, **kwargs)
 
@@ -200,8 +346,14 @@ class FeedForward(nn.Module):
             Linear(dim * mult, dim)
         )
 
-    def forward(self, x, **kwargs):
-        return self.net(x)
+    def forward(self, x, out_features=None, **kwargs):
+        if out_features is None:
+            return self.net(x)
+        #solo las primeras out_features salidas (la parte del CLS en la atención entre filas)
+        x = self.net[2](self.net[1](self.net[0](x)))
+        if not isinstance(self.net[3], nn.Linear): #capa cuantizada
+            return self.net[3](x)[..., :out_features]
+        return F.linear(x, self.net[3].weight[:out_features], self.net[3].bias[:out_features])
 
     def relprop(self, cam=None, **kwargs):
         #TODO
@@ -243,7 +395,7 @@ class SAINT_Transformer(nn.Module):
     #solo de RowCol: nfeats, style='col'
 
 
-    def __init__(self, num_tokens, dim, nfeats, depth, heads, dim_head, attn_dropout, ff_dropout, style='col'):
+    def __init__(self, num_tokens, dim, nfeats, depth, heads, dim_head, attn_dropout, ff_dropout, style='col', row_memory_budget=None, row_topk=None):
         super().__init__()
         
         # asignamos los valores a las variables
@@ -262,13 +414,13 @@ class SAINT_Transformer(nn.Module):
                 self.layers.append(nn.ModuleList([
                     PreNorm(dim, Residual(Attention(dim, heads = heads, dim_head = dim_head, dropout = attn_dropout))),
                     PreNorm(dim, Residual(FeedForward(dim, dropout = ff_dropout))),
-                    PreNorm(dim*nfeats, Residual(Attention(dim*nfeats, heads = heads, dim_head = 64, dropout = attn_dropout))),
+                    PreNorm(dim*nfeats, Residual(Attention(dim*nfeats, heads = heads, dim_head = 64, dropout = attn_dropout, memory_budget = row_memory_budget, topk = row_topk, rows = True))),
                     PreNorm(dim*nfeats, Residual(FeedForward(dim*nfeats, dropout = ff_dropout))),
                 ]))
         
             elif self.style == 'row':
                 self.layers.append(nn.ModuleList([
-                    PreNorm(dim*nfeats, Residual(Attention(dim*nfeats, heads = heads, dim_head = 64, dropout = attn_dropout))),
+                    PreNorm(dim*nfeats, Residual(Attention(dim*nfeats, heads = heads, dim_head = 64, dropout = attn_dropout, memory_budget = row_memory_budget, topk = row_topk, rows = True))),
                     PreNorm(dim*nfeats, Residual(FeedForward(dim*nfeats, dropout = ff_dropout))),
                 ]))
 
@@ -282,27 +434,42 @@ class SAINT_Transformer(nn.Module):
                 print("ERROR - ")
 
     
-    def forward(self, x, x_cont=None, mask = None): #TODO: mask no se utiliza, REVISAR
+    def forward(self, x, x_cont=None, mask = None, cls_only = False):
+        #cls_only: la última capa solo calcula la salida del token CLS y se devuelve (b, 1, d); para predecir solo
+        #se usa reps[:,0,:]. No vale para relprop, que necesita la salida completa
+        #mask: (b,) booleano, las filas a False (relleno) no se atienden en la atención entre filas
         if x_cont is not None:
             x = torch.cat((x, x_cont), dim=1)
-        _, n, _ = x.shape
+        _, n, d = x.shape
+        last = len(self.layers) - 1 if cls_only else -1
         if self.style == 'colrow':
-            for attn1, ff1, attn2, ff2 in self.layers: 
+            for i, (attn1, ff1, attn2, ff2) in enumerate(self.layers): 
                 x = attn1(x)
                 x = ff1(x)
                 x = rearrange(x, 'b n d -> 1 b (n d)')
-                x = attn2(x)
-                x = ff2(x)
-                x = rearrange(x, '1 b (n d) -> b n d', n = n)
+                x = attn2(x, mask = mask)
+                if i == last:
+                    x = ff2(x, out_features = d)
+                    x = rearrange(x, '1 b d -> b 1 d')
+                else:
+                    x = ff2(x)
+                    x = rearrange(x, '1 b (n d) -> b n d', n = n)
         elif self.style == 'row':
-            for attn1, ff1 in self.layers:
+            for i, (attn1, ff1) in enumerate(self.layers):
                 x = rearrange(x, 'b n d -> 1 b (n d)')
-                x = attn1(x)
-                x = ff1(x)
-                x = rearrange(x, '1 b (n d) -> b n d', n = n)
+                x = attn1(x, mask = mask)
+                if i == last:
+                    x = ff1(x, out_features = d)
+                    x = rearrange(x, '1 b d -> b 1 d')
+                else:
+                    x = ff1(x)
+                    x = rearrange(x, '1 b (n d) -> b n d', n = n)
         elif self.style == 'col':
-            for attn1, ff1 in self.layers:
-                x = attn1(x)
+            for i, (attn1, ff1) in enumerate(self.layers):
+                if i == last:
+                    x = attn1(x, cls_only = True)
+                else:
+                    x = attn1(x)
                 x = ff1(x)
         else:
             print("ERROR - ")
@@ -1,3 +1,7 @@
 from models.SAINT_Transformer import SAINT_Transformer
 from models.SAINT import SAINT
-from models.ExplainationGenerator import ExplainationGenerator
\ No newline at end of file
+from models.ExplainationGenerator import ExplainationGenerator
+from models.SAINTPredictor import SAINTPredictor, SAINTInference
+from models.SAINTQuantized import quantize_saint
+from models.SAINTOnnx import export_onnx
+from models.RolloutExplainer import RolloutExplainer
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#Exporta a ONNX un SAINT entrenado sobre una partición guardada (entradas en bruto -> logits) y comprueba la
+#paridad de onnxruntime frente a la salida eager en la partición de test. Ejemplo:
+#   onnx_export.py --dset_id 54 --task multiclass --fold 0 --epochs 20 --output saint.onnx
+import argparse
+import numpy as np
+import torch
+import onnxruntime
+
+import models
+from datasets.loadData import TensorLoader
+from functions import base_parser, adjust_options, load_fold, create_model, select_criterion, select_optimizer, train
+from models.SAINTPredictor import SAINTInference
+
+parser = argparse.ArgumentParser(parents=[base_parser()])
+parser.add_argument('--fold', default=0, type=int)
+parser.add_argument('--output', default='saint.onnx', type=str)
+parser.add_argument('--opset', default=17, type=int)
+parser.add_argument('--tolerance', default=1e-4, type=float)
+parser.set_defaults(epochs=20)
+opt = parser.parse_args()
+
+torch.manual_seed(opt.set_seed)
+device = torch.device("cpu")
+
+folders = load_fold(opt)
+adjust_options(opt, folders["train"].num_features()) #mismos ajustes que main.py
+
+y_dim = folders["train"].num_classes
+trainloader = TensorLoader(folders["train"], batch_size=opt.batchsize, shuffle=True)
+
+print("Entrenando SAINT (" + str(opt.epochs) + " epochs) en el dataset " + str(opt.dset_id) + ", fold " + str(opt.fold) + "...")
+model = create_model(folders["train"], y_dim, opt).to(device)
+optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, opt.epochs, opt.lr)
+model = train(model, trainloader, opt.task, opt.epochs, device, select_criterion(y_dim, opt.task, device), opt.optimizer, optimizer, scheduler)
+model.eval()
+
+x_categ, x_cont, y_gts, cat_mask, con_mask = next(iter(TensorLoader(folders["test"], batch_size=len(folders["test"]), shuffle=False)))
+x_cont = x_cont.float()
+models.export_onnx(model, opt.output, x_categ, x_cont, cat_mask, con_mask, opset_version=opt.opset)
+print("Modelo exportado en " + opt.output)
+
+#paridad con la salida eager, con el batch completo y con un batch más pequeño (eje de batch dinámico)
+session = onnxruntime.InferenceSession(opt.output, providers=['CPUExecutionProvider'])
+inference = SAINTInference(model).eval()
+for n in [len(y_gts), min(5, len(y_gts))]:
+    feed = {'x_categ': x_categ[:n].numpy(), 'x_cont': x_cont[:n].numpy(), 'cat_mask': cat_mask[:n].numpy(), 'con_mask': con_mask[:n].numpy()}
+    y_onnx = session.run(None, feed)[0]
+    with torch.no_grad():
+        y_eager = inference(x_categ[:n], x_cont[:n], cat_mask[:n], con_mask[:n]).numpy()
+    diff = np.abs(y_onnx - y_eager).max()
+    same = (y_onnx.argmax(axis=1) == y_eager.argmax(axis=1)).mean()
+    print("batch %5d: diferencia máxima %.2e, predicciones iguales %.2f%%" % (n, diff, 100 * same))
+    if diff > opt.tolerance:
+        raise Exception('La salida ONNX difiere de la eager (' + str(diff) + ' > ' + str(opt.tolerance) + ')')
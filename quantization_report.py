@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#Informe de paridad de la copia int8 (cuantización dinámica) de SAINT frente al modelo float sobre la partición
+#de test guardada. Solo se cuantizan las capas lineales (ver models.quantize_saint). Ejemplo:
+#   quantization_report.py --dset_id 54 --task multiclass --fold 0 --epochs 20
+import argparse
+import io
+import time
+import torch
+
+import models
+from datasets.loadData import TensorLoader
+from functions import base_parser, adjust_options, load_fold, create_model, create_metric, select_criterion, select_optimizer, train, predict
+
+parser = argparse.ArgumentParser(parents=[base_parser()])
+parser.add_argument('--fold', default=0, type=int)
+parser.set_defaults(epochs=20)
+opt = parser.parse_args()
+
+torch.manual_seed(opt.set_seed)
+device = torch.device("cpu") #la cuantización dinámica solo tiene kernels de CPU
+
+folders = load_fold(opt)
+adjust_options(opt, folders["train"].num_features()) #mismos ajustes que main.py
+
+y_dim = folders["train"].num_classes
+trainloader = TensorLoader(folders["train"], batch_size=opt.batchsize, shuffle=True)
+testloader = TensorLoader(folders["test"], batch_size=len(folders["test"]), shuffle=False)
+
+print("Entrenando SAINT (" + str(opt.epochs) + " epochs) en el dataset " + str(opt.dset_id) + ", fold " + str(opt.fold) + "...")
+model = create_model(folders["train"], y_dim, opt).to(device)
+optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, opt.epochs, opt.lr)
+model = train(model, trainloader, opt.task, opt.epochs, device, select_criterion(y_dim, opt.task, device), opt.optimizer, optimizer, scheduler)
+qmodel = models.quantize_saint(model)
+
+def size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+def evaluate(model):
+    y_pred, y_gts = predict(model, testloader, device)
+    start = time.perf_counter()
+    for _ in range(10):
+        predict(model, testloader, device)
+    latency = (time.perf_counter() - start) / 10
+    metric, _ = create_metric(opt.task, y_dim, device)
+    return y_pred, y_gts, metric(torch.squeeze(y_pred), torch.squeeze(y_gts)).item(), latency
+
+y_float, y_gts, acc_float, lat_float = evaluate(model)
+y_int8, _, acc_int8, lat_int8 = evaluate(qmodel)
+
+print("\n%-8s %10s %14s %12s" % ("modelo", "accuracy", "latencia (ms)", "tamaño (MB)"))
+print("%-8s %10.4f %14.2f %12.2f" % ("float32", acc_float, lat_float * 1000, size_mb(model)))
+print("%-8s %10.4f %14.2f %12.2f" % ("int8", acc_int8, lat_int8 * 1000, size_mb(qmodel)))
+print("\nDiferencia de accuracy (int8 - float32): %.4f" % (acc_int8 - acc_float))
+print("Predicciones iguales: %.2f%% de %d ejemplos de test" % (100 * (y_float == y_int8).float().mean().item(), len(y_gts)))
+
+#lo que la cuantización dinámica no convierte (ver models.quantize_saint)
+float_params = sum(p.numel() for p in qmodel.parameters())
+continuous_params = sum(p.numel() for name, p in qmodel.named_parameters() if name.startswith("simple_MLP."))
+print("\nParámetros que siguen en float32 en la copia int8: %d de %d (%d del embedding de las continuas)" % (float_params, sum(p.numel() for p in model.parameters()), continuous_params))
+print("La copia int8 no tiene los hooks de relprop: las explicaciones se calculan con el modelo float32")
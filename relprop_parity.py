@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#Comprueba que la relprop de utils.Linear (forma cerrada, sin autograd) da lo mismo que la implementación original
+#con torch.autograd.grad (Linear.relprop_autograd), capa a capa y en la explicación completa, y compara tiempos.
+#Ejemplo:
+#   relprop_parity.py --dset_id 54 --task multiclass --fold 0 --epochs 5
+import argparse
+import time
+import torch
+
+import models
+import utils
+from datasets.loadData import TensorLoader
+from functions import base_parser, adjust_options, load_fold, create_model, select_criterion, select_optimizer, train, embed_data_mask
+
+parser = argparse.ArgumentParser(parents=[base_parser()])
+parser.add_argument('--fold', default=0, type=int)
+parser.add_argument('--repeats', default=3, type=int)
+parser.add_argument('--tolerance', default=1e-5, type=float) #diferencia relativa máxima admitida
+parser.set_defaults(epochs=5)
+opt = parser.parse_args()
+
+torch.manual_seed(opt.set_seed)
+device = torch.device("cpu")
+
+dataset = load_fold(opt, ["train"])["train"]
+
+#la explicación LRP solo está implementada para colrow; mismos ajustes que main.py
+opt.attentiontype = 'colrow'
+adjust_options(opt, dataset.num_features())
+y_dim = dataset.num_classes
+model = create_model(dataset, y_dim, opt).to(device)
+optimizer, scheduler = select_optimizer(model, opt.optimizer, opt.scheduler, opt.epochs, opt.lr)
+model = train(model, TensorLoader(dataset, batch_size=opt.batchsize, shuffle=True), opt.task, opt.epochs, device, select_criterion(y_dim, opt.task, device), opt.optimizer, optimizer, scheduler)
+
+x_categ, x_cont, _, cat_mask, con_mask = dataset.batch(slice(0, opt.batchsize))
+_ , x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, model)
+x_categ_enc, x_cont_enc = x_categ_enc.detach(), x_cont_enc.detach()
+explainator = models.ExplainationGenerator(model)
+
+def explain(relprop):
+    #sustituye la relprop de todas las utils.Linear y guarda la relevancia que sale de cada una
+    relevances = {}
+    def wrapped(self, R, alpha):
+        relevances[self] = relprop(self, R, alpha).detach()
+        return relevances[self]
+    original = utils.Linear.relprop
+    utils.Linear.relprop = wrapped
+    try:
+        start = time.perf_counter()
+        for _ in range(opt.repeats):
+            rollout, _ = explainator.generateExplanation_all(x_categ_enc, x_cont_enc, device)
+        elapsed = (time.perf_counter() - start) / opt.repeats
+    finally:
+        utils.Linear.relprop = original
+    return rollout.detach(), relevances, elapsed
+
+rollout_closed, relevances_closed, time_closed = explain(utils.Linear.relprop)
+rollout_autograd, relevances_autograd, time_autograd = explain(utils.Linear.relprop_autograd)
+
+def relative_diff(a, b):
+    return ((a - b).abs().max() / b.abs().max().clamp(min=1e-12)).item()
+
+names = {module: name for name, module in model.named_modules()}
+worst = 0.0
+print("%-45s %20s" % ("capa", "diferencia relativa"))
+for module, relevance in relevances_autograd.items():
+    diff = relative_diff(relevances_closed[module], relevance)
+    worst = max(worst, diff)
+    print("%-45s %20.2e" % (names[module], diff))
+diff = relative_diff(rollout_closed, rollout_autograd)
+worst = max(worst, diff)
+print("%-45s %20.2e" % ("explicación (rollout)", diff))
+print("\nExplicación de " + str(x_categ.shape[0]) + " filas: %.3f s con autograd, %.3f s en forma cerrada (%.2fx)" % (time_autograd, time_closed, time_autograd / time_closed))
+if worst > opt.tolerance:
+    raise Exception("La relprop en forma cerrada difiere de la original en " + str(worst))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#Telemetría opcional del entrenamiento/explicación de SAINT: tiempo por epoch, filas/s, reparto del tiempo entre
+#fases (loader, embed_data_mask, transformer, mlpfory, backward, optimizador...) y memoria (RSS): pico de cada
+#sección muestreado en cada fase y pico de todo el proceso.
+#Sin --telemetry se usa NO_TELEMETRY, cuyas llamadas no hacen nada.
+import csv
+import json
+import os
+import time
+import torch
+from contextlib import contextmanager, nullcontext
+try:
+    import resource #solo Unix
+except ImportError:
+    resource = None
+
+
+def rss_mb():
+    #RSS actual (solo Linux); None si no se puede leer
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def process_peak_rss_mb():
+    #pico de RSS de todo el proceso desde que arrancó (no baja aunque se libere memoria)
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 #ru_maxrss viene en KB en Linux
+
+
+class Telemetry:
+    def __init__(self, device, info=None):
+        #en GPU las operaciones son asíncronas: se sincroniza antes de cada medida para que el tiempo caiga en su fase
+        self.cuda = torch.device(device).type == 'cuda'
+        self.trace = {"info": info or {}, "phases": {}, "epochs": [], "explain": None}
+        self.section = None
+        self.last = time.perf_counter()
+
+    def now(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start(self, **fields):
+        #empieza una sección (una epoch o la explicación)
+        self.section = dict(fields)
+        self.section["samples"] = 0
+        self.rss = rss_mb()
+        self.section_start = self.last = self.now()
+
+    def lap(self, name):
+        #suma a la fase name el tiempo desde la última marca
+        now = self.now()
+        self.section[name] = self.section.get(name, 0.0) + now - self.last
+        self.sample_rss()
+        self.last = now
+
+    def sample_rss(self):
+        #la RSS se muestrea al final de cada fase; el pico de la sección es el máximo de esas muestras
+        rss = rss_mb()
+        if rss is not None and (self.rss is None or rss > self.rss):
+            self.rss = rss
+
+    def samples(self, n):
+        self.section["samples"] += n
+
+    def end(self, **fields):
+        section = self.section
+        section.update(fields)
+        section["wall"] = self.now() - self.section_start
+        section["samples_per_s"] = section["samples"] / section["wall"] if section["wall"] > 0 else None
+        self.sample_rss()
+        section["peak_rss_mb"] = self.rss
+        section["process_peak_rss_mb"] = process_peak_rss_mb()
+        if self.cuda:
+            section["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 2**20
+        self.section = None
+        return section
+
+    def end_epoch(self, **fields):
+        self.trace["epochs"].append(self.end(**fields))
+
+    def export_epochs(self):
+        #epochs medidas en otro proceso (el proceso 0 del entrenamiento distribuido) para añadirlas con import_epochs
+        return self.trace["epochs"]
+
+    def import_epochs(self, epochs):
+        self.trace["epochs"] += epochs
+
+    def end_explain(self, **fields):
+        self.trace["explain"] = self.end(**fields)
+
+    @contextmanager
+    def phase(self, name):
+        #fases gruesas de cross_validation_process (train, predict, explain)
+        start = self.now()
+        yield
+        self.trace["phases"][name] = self.now() - start
+
+    def save(self, path):
+        #path sin extensión: traza completa en .json y las epochs en .csv
+        self.trace["process_peak_rss_mb"] = process_peak_rss_mb()
+        with open(path + ".json", "w") as file:
+            json.dump(self.trace, file, indent=1)
+        if self.trace["epochs"]:
+            columns = []
+            for epoch in self.trace["epochs"]:
+                columns += [key for key in epoch if key not in columns]
+            with open(path + ".csv", "w", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(self.trace["epochs"])
+
+
+class NoTelemetry:
+    def start(self, **fields):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def samples(self, n):
+        pass
+
+    def end_epoch(self, **fields):
+        pass
+
+    def export_epochs(self):
+        return []
+
+    def import_epochs(self, epochs):
+        pass
+
+    def end_explain(self, **fields):
+        pass
+
+    def phase(self, name):
+        return nullcontext()
+
+    def save(self, path):
+        pass
+
+
+NO_TELEMETRY = NoTelemetry()
@@ -7,8 +7,15 @@ class RelProp(nn.Module):
     def __init__(self):
         super(RelProp, self).__init__()
         # if not self.training:
+        self.relprop_enabled = False #solo se guardan las entradas (self.X) dentro de SAINT.relprop_mode()
+        self.relprop_lean = False
         self.register_forward_hook(functions.forward_hook)
 
+    def release(self):
+        #con SAINT.relprop_mode(lean=True) la entrada guardada se libera en cuanto su relprop la ha usado
+        if self.relprop_lean:
+            self.__dict__.pop('X', None)
+
     def gradprop(self, Z, X, S):
         C = torch.autograd.grad(Z, X, S, retain_graph=True)
         return C
@@ -18,6 +25,33 @@ class RelProp(nn.Module):
 
 class Linear(nn.Linear, RelProp):
     def relprop(self, R, alpha):
+        #regla alpha-beta; para una capa lineal el gradiente de F.linear(x, w) respecto a x con gradiente de salida S
+        #es directamente S @ w, así que no hace falta autograd (mismo resultado que relprop_autograd)
+        beta = alpha - 1
+        X = self.X.detach()
+        pw = torch.clamp(self.weight.detach(), min=0)
+        nw = torch.clamp(self.weight.detach(), max=0)
+        px = torch.clamp(X, min=0)
+        nx = torch.clamp(X, max=0)
+
+        def f(w1, w2, x1, x2):
+            Z1 = F.linear(x1, w1)
+            Z2 = F.linear(x2, w2)
+            S = functions.safe_divide(R, Z1 + Z2)
+            C1 = x1 * torch.matmul(S, w1)
+            C2 = x2 * torch.matmul(S, w2)
+
+            return C1 + C2
+
+        R = alpha * f(pw, nw, px, nx)
+        if beta != 0: #con alpha = 1 (el valor que se usa) los inhibidores no aportan
+            R = R - beta * f(nw, pw, px, nx)
+        self.release()
+
+        return R
+
+    def relprop_autograd(self, R, alpha):
+        #implementación original con torch.autograd.grad, como referencia (ver relprop_parity.py)
         beta = alpha - 1
         pw = torch.clamp(self.weight, min=0)
         nw = torch.clamp(self.weight, max=0)
@@ -38,6 +72,7 @@ class Linear(nn.Linear, RelProp):
         inhibitor_relevances = f(nw, pw, px, nx)
 
         R = alpha * activator_relevances - beta * inhibitor_relevances
+        self.release()
 
         return R
 
@@ -57,6 +92,7 @@ class Clone(RelProp):
         S = [functions.safe_divide(r, z) for r, z in zip(R, Z)]
         C = self.gradprop(Z, self.X, S)[0]
         R = self.X * C
+        self.release()
         return R
 
 class RelPropSimple(RelProp):
@@ -71,6 +107,7 @@ class RelPropSimple(RelProp):
             outputs.append(self.X[1] * C[1])
         else:
             outputs = self.X * (C[0])
+        self.release()
         return outputs
 
 class MatMul(RelPropSimple):